@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.ASYNC_DB_THREADS,
+        thread_name_prefix='db',
+    )
+
+
+def run_view(view, request, *args, **kwargs):
+    """Выполняет view в потоке пула и готовит ответ к отправке.
+
+    У каждого потока пула своё соединение с БД, оно живёт между
+    запросами в пределах CONN_MAX_AGE, как в обычном воркере.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read_view(view):
+    """Асинхронная обёртка над синхронным представлением DRF.
+
+    Django 3.2 не умеет асинхронно работать с ORM, поэтому под ASGI
+    все синхронные представления воркера выполняются по очереди в одном
+    потоке. Безопасные запросы обёртка отправляет в пул из
+    ASYNC_DB_THREADS потоков: медленный запрос к БД занимает один поток
+    пула, а не весь воркер, медленных клиентов обслуживает event loop.
+    Изменяющие запросы, а при ASYNC_DB_THREADS = 0 и все остальные,
+    выполняются как обычно.
+    """
+    write_view = sync_to_async(view, thread_sensitive=True)
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if (
+            request.method not in SAFE_METHODS
+            or not settings.ASYNC_DB_THREADS
+        ):
+            return await write_view(request, *args, **kwargs)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            get_executor(),
+            functools.partial(
+                context.run, run_view, view, request, *args, **kwargs
+            )
+        )
+
+    return wrapper
@@ -0,0 +1,149 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from foodgram.metrics import serializer_data
+from recipes.cache import INGREDIENTS, TAGS, get_version, version_time
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
+
+
+def make_etag(*parts):
+    """Сильный ETag от значений, однозначно задающих содержимое ответа."""
+    return f'"{hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()}"'
+
+
+class ConditionalRecipeMixin:
+    """Условные GET для list и retrieve рецептов.
+
+    ETag считается по id и дате изменения рецептов и их авторов, флагам
+    текущего пользователя и версиям тегов и ингредиентов, поэтому при
+    совпадении If-None-Match ответ 304 отдаётся без подгрузки связей и
+    работы сериализатора. Last-Modified отдаётся только анонимам: для
+    них флаги постоянны.
+    """
+    shared_versions = (TAGS, INGREDIENTS)
+
+    def get_shared_versions(self):
+        """Версии общих данных, входящих в ответ: тегов и ингредиентов."""
+        return [get_version(name) for name in self.shared_versions]
+
+    def get_last_modified(self, recipes, versions):
+        return max(
+            [recipe.updated for recipe in recipes]
+            + [recipe.author_updated for recipe in recipes
+               if recipe.author_updated]
+            + [version_time(version) for version in versions]
+        )
+
+    def prepare_page(self, recipes):
+        """Дополняет загруженные рецепты страницы перед сериализацией."""
+        return recipes
+
+    def conditional_response(self, request, etag, last_modified=None):
+        if not request.user.is_anonymous:
+            last_modified = None
+        return get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified and int(last_modified.timestamp()),
+        )
+
+    def finalize_conditional(self, response, etag, last_modified=None):
+        response['ETag'] = etag
+        if last_modified and self.request.user.is_anonymous:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = get_object_or_404(
+            self.get_queryset().versions(request.user),
+            pk=kwargs[self.lookup_url_kwarg or self.lookup_field]
+        )
+        versions = self.get_shared_versions()
+        etag = make_etag(*recipe.version, versions)
+        last_modified = self.get_last_modified([recipe], versions)
+        response = self.conditional_response(request, etag, last_modified)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return self.finalize_conditional(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.versions(request.user))
+        if page is None:
+            return super().list(request, *args, **kwargs)
+        versions = self.get_shared_versions()
+        etag = make_etag(
+            request.build_absolute_uri(),
+            self.paginator.get_count(),
+            [recipe.version for recipe in page],
+            versions,
+        )
+        last_modified = self.get_last_modified(page, versions)
+        response = self.conditional_response(request, etag, last_modified)
+        if response is None:
+            ids = [recipe.id for recipe in page]
+            recipes = self.get_queryset().in_bulk(ids)
+            serializer = self.get_serializer(
+                self.prepare_page(
+                    [recipes[pk] for pk in ids if pk in recipes]
+                ),
+                many=True
+            )
+            response = self.get_paginated_response(
+                serializer_data(serializer)
+            )
+        return self.finalize_conditional(response, etag, last_modified)
+
+
+class CachedResponseMixin:
+    """Кэширует готовый JSON ответов list и retrieve.
+
+    Ключ содержит версию набора данных cache_version_name, поэтому при
+    её увеличении все закэшированные ответы устаревают разом. Ответ
+    отдаётся с сильным ETag, на совпадающий If-None-Match - 304.
+    """
+    cache_version_name = None
+
+    def get_cache_key(self, request):
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        params = hashlib.sha1(
+            request.GET.urlencode().encode('utf-8')
+        ).hexdigest()
+        return (
+            f'response:{self.cache_version_name}:'
+            f'{get_version(self.cache_version_name)}:'
+            f'{self.action}:{lookup}:{params}'
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        cached = cache.get(key)
+        if cached is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = JSONRenderer().render(response.data)
+            cached = (f'"{hashlib.sha256(body).hexdigest()}"', body)
+            cache.set(key, cached, settings.RESPONSE_CACHE_TIMEOUT)
+        etag, body = cached
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
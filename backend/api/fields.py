@@ -0,0 +1,89 @@
+import base64
+import binascii
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from recipes.images import process_image
+from rest_framework import serializers
+
+
+class RecipeImageField(Base64ImageField):
+    """Base64ImageField с уменьшением изображения и подготовкой вариантов.
+
+    Возвращает recipes.images.ProcessedImage, варианты которого
+    сохраняет сериализатор после сохранения рецепта. Изображение
+    декодируется один раз, при обработке: проверка формата тоже там.
+    """
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        _, _, data = data.rpartition(';base64,')
+        try:
+            content = base64.b64decode(data)
+        except (TypeError, binascii.Error, ValueError):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        try:
+            return process_image(content)
+        except (
+            OSError,
+            TimeoutError,
+            BrokenProcessPool,
+            Image.DecompressionBombError,
+        ):
+            raise serializers.ValidationError(
+                'Не удалось обработать изображение.'
+            )
+
+
+def resolve_primary_keys(queryset, ids):
+    """Объекты queryset с первичными ключами ids одним запросом.
+
+    Сообщает сразу обо всех повторяющихся и несуществующих id.
+    Возвращает объекты в порядке ids.
+    """
+    seen = set()
+    duplicates = []
+    for pk in ids:
+        if pk in seen and pk not in duplicates:
+            duplicates.append(pk)
+        seen.add(pk)
+    objects = queryset.in_bulk(seen) if seen else {}
+    missing = [pk for pk in ids if pk not in objects]
+    errors = []
+    if duplicates:
+        errors.append(
+            'Повторяются id: ' + ', '.join(map(str, duplicates)) + '.'
+        )
+    if missing:
+        errors.append(
+            'Не найдены id: ' + ', '.join(map(str, missing)) + '.'
+        )
+    if errors:
+        raise serializers.ValidationError(errors)
+    return [objects[pk] for pk in ids]
+
+
+class PrimaryKeyListField(serializers.ListField):
+    """Список первичных ключей, проверяемый одним запросом IN.
+
+    В отличие от PrimaryKeyRelatedField(many=True) не делает
+    отдельный запрос на каждый id.
+    """
+
+    def __init__(self, queryset, **kwargs):
+        self.queryset = queryset
+        kwargs.setdefault('child', serializers.IntegerField(min_value=1))
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        return resolve_primary_keys(
+            self.queryset.all(), super().to_internal_value(data)
+        )
+
+    def to_representation(self, data):
+        return [obj.pk for obj in data.all()]
@@ -1,9 +1,13 @@
 from django_filters.rest_framework import FilterSet, filters
 from django.contrib.auth import get_user_model
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
 
 User = get_user_model()
 
+POPULAR = 'popular'
+POPULAR_ORDERING = ('-favorites_count', '-created', 'id')
+
 
 class IngredientFilter(FilterSet):
     """Фильтр ингредиентов."""
@@ -26,24 +30,39 @@ class TagFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='check_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=((POPULAR, 'По популярности'),),
+        method='order_recipes',
+    )
 
     def check_is_favorited(self, queryset, name, value):
         current_user = self.request.user
         if current_user.is_authenticated and value:
-            return queryset.filter(favorite_recipe__user=current_user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def check_is_in_shopping_cart(self, queryset, name, value):
         current_user = self.request.user
         if current_user.is_authenticated and value:
-            return queryset.filter(recipe_in_shopping_cart__user=current_user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def order_recipes(self, queryset, name, value):
+        return queryset.order_by(*POPULAR_ORDERING)
+
     class Meta:
         model = Recipe
         fields = [
             'tags',
             'author',
             'is_favorited',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search',
+            'ordering',
         ]
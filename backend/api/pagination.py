@@ -1,6 +1,196 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу сортировки вместо OFFSET.
+
+    Курсор хранит значения полей ordering у граничной записи, следующая
+    страница выбирается условием "строго после неё". Такие курсоры не
+    сдвигаются при добавлении новых записей и не требуют COUNT(*).
+    Общее количество считается по желанию и кэшируется на
+    PAGINATION_COUNT_CACHE_TIMEOUT секунд, при 0 не отдаётся.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, cursor['p'])
+            ]
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return position, bool(cursor['r'])
+        except (KeyError, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        position = [
+            getattr(obj, field.lstrip('-')) for field in self.ordering
+        ]
+        cursor = json.dumps(
+            {'p': position, 'r': int(reverse)},
+            default=str,
+        )
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            base64.urlsafe_b64encode(cursor.encode()).decode()
+        )
+
+    @staticmethod
+    def after(ordering, position):
+        """Условие "строго после position" для сортировки ordering."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_count(self, queryset):
+        timeout = settings.PAGINATION_COUNT_CACHE_TIMEOUT
+        if not timeout:
+            return None
+        key = 'count:' + hashlib.sha1(
+            str(queryset.order_by().query).encode('utf-8')
+        ).hexdigest()
+        return cache.get_or_set(key, queryset.count, timeout)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            )
+        self.count = self.get_count(queryset)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = page
+        return page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(
+                self.base_url, self.cursor_query_param, ''
+            )
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        fields = [
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]
+        if self.count is not None:
+            fields.insert(0, ('count', self.count))
+        return Response(OrderedDict(fields))
+
+
+class FeedPagination(KeysetPagination):
+    """Курсор ленты по записям (created, id), только вперёд и без count.
+
+    Курсор строится по записи ленты, а не по загруженному рецепту,
+    поэтому удалённые рецепты не обрывают пагинацию.
+    """
+    Entry = namedtuple('Entry', 'created id')
+
+    def __init__(self):
+        super().__init__(('-created', '-id'))
+
+    def paginate_feed(self, read_page, request, model):
+        """Страница записей, read_page(position, limit) даёт limit + 1."""
+        self.base_url = request.build_absolute_uri()
+        self.count = None
+        position, _ = self.decode_cursor(request, model)
+        limit = self.get_page_size(request)
+        entries = [
+            self.Entry(*entry) for entry in read_page(position, limit)
+        ]
+        self.has_next = len(entries) > limit
+        self.has_previous = False
+        self.page = entries[:limit]
+        return self.page
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с переключением на KeysetPagination.
+
+    Режим по ключу включается параметром cursor (для первой страницы
+    пустым), если у представления задан keyset_ordering.
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', None)
+        if (ordering
+                and KeysetPagination.cursor_query_param
+                in request.query_params):
+            self.keyset = KeysetPagination(ordering)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_count(self):
+        if self.keyset:
+            return self.keyset.count
+        return self.page.paginator.count
@@ -0,0 +1,135 @@
+import csv
+import io
+import json
+import os
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework import renderers
+
+NAME = 'ingredient__name'
+UNIT = 'ingredient__measurement_unit'
+TOTAL = 'ingredient_total'
+
+
+class _Echo:
+    """Псевдобуфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """Базовый рендерер файла со списком покупок.
+
+    Наследники реализуют ``lines`` и выдают файл построчно, чтобы его
+    можно было отдавать через StreamingHttpResponse, не собирая целиком
+    в памяти. ``render`` используется DRF только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def lines(self, rows):
+        raise NotImplementedError
+
+    def stream(self, rows):
+        """Отдаёт файл кусками примерно по SHOPPING_LIST_STREAM_CHUNK байт."""
+        buffer = []
+        size = 0
+        for line in self.lines(rows):
+            chunk = line.encode(self.charset)
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= settings.SHOPPING_LIST_STREAM_CHUNK:
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield b''.join(buffer)
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def lines(self, rows):
+        writer = csv.writer(_Echo())
+        for row in rows:
+            yield writer.writerow((row[NAME], row[UNIT], row[TOTAL]))
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def lines(self, rows):
+        yield 'Список покупок\n\n'
+        for row in rows:
+            yield f'• {row[NAME]} ({row[UNIT]}) — {row[TOTAL]}\n'
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """Рендерер PDF.
+
+    Таблица перекрёстных ссылок PDF пишется в конец файла, поэтому
+    документ собирается в памяти и отдаётся после чтения всех строк.
+    Для кириллицы нужен TTF-шрифт из SHOPPING_LIST_PDF_FONT.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_size = 12
+    margin = 50
+
+    def get_font(self):
+        font_path = settings.SHOPPING_LIST_PDF_FONT
+        if not font_path or not os.path.exists(font_path):
+            return 'Helvetica'
+        font_name = os.path.splitext(os.path.basename(font_path))[0]
+        if font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(font_name, font_path))
+        return font_name
+
+    def stream(self, rows):
+        font = self.get_font()
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        line_height = self.font_size * 1.5
+        pdf.setTitle('Список покупок')
+        y = height - self.margin
+        pdf.setFont(font, self.font_size + 4)
+        pdf.drawString(self.margin, y, 'Список покупок')
+        y -= line_height * 2
+        pdf.setFont(font, self.font_size)
+        for row in rows:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin, y,
+                f'• {row[NAME]} ({row[UNIT]}) — {row[TOTAL]}'
+            )
+            y -= line_height
+        pdf.save()
+        buffer.seek(0)
+        while True:
+            chunk = buffer.read(settings.SHOPPING_LIST_STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+SHOPPING_LIST_RENDERERS = [
+    CSVShoppingListRenderer,
+    TextShoppingListRenderer,
+    PDFShoppingListRenderer,
+]
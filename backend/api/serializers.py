@@ -1,3 +1,4 @@
+from django.core.files.storage import default_storage
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer, UserSerializer
@@ -11,9 +12,19 @@ from recipes.models import (
     Tag,
     Favorite,
     ShoppingCart,
+    ShoppingCartTotal,
 )
+from recipes.counters import change_counter
+from recipes.images import ProcessedImage
+from recipes.search import update_search_vectors
 from users.models import Follow
 
+from .fields import (
+    PrimaryKeyListField,
+    RecipeImageField,
+    resolve_primary_keys,
+)
+
 User = get_user_model()
 
 
@@ -33,12 +44,13 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request', None)
-        if request:
-            current_user = request.user
-
+        if request is None or request.user.is_anonymous:
+            return False
         return Follow.objects.filter(
-            user=current_user.id,
+            user=request.user,
             author=obj.id).exists()
 
 
@@ -64,10 +76,7 @@ class ReadOnlyIngredientAmountSerializer(serializers.ModelSerializer):
 
 class CreateIngredientsAmountSerializer(serializers.ModelSerializer):
     """Сериализатор создания количества ингредиентов."""
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        read_only=False,
-    )
+    id = serializers.IntegerField(min_value=1)
 
     def validate_amount(self, value):
         if value < 1:
@@ -88,6 +97,19 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
+def image_variant_urls(recipe, request=None):
+    """Ссылки на варианты изображения: {ширина: {расширение: url}}."""
+    urls = {}
+    for width, variants in recipe.image_variants.items():
+        urls[width] = {}
+        for extension, name in variants.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[width][extension] = url
+    return urls
+
+
 class ReadOnlyRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор чтения рецептов."""
     tags = TagSerializer(many=True)
@@ -103,6 +125,8 @@ class ReadOnlyRecipeSerializer(serializers.ModelSerializer):
         method_name='check_is_in_shopping_cart'
     )
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
+    search_highlight = serializers.SerializerMethodField()
 
     class Meta:
         read_only_fields = ['__all__']
@@ -116,32 +140,101 @@ class ReadOnlyRecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
+            'search_highlight',
         ]
 
-    def is_in_list(self, obj, model):
+    def get_image_variants(self, recipe):
+        return image_variant_urls(recipe, self.context.get('request'))
+
+    def get_search_highlight(self, recipe):
+        return getattr(recipe, 'search_highlight', None)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data['search_highlight'] is None:
+            del data['search_highlight']
+        return data
+
+    def is_in_list(self, obj, model, annotation):
+        if hasattr(obj, annotation):
+            return getattr(obj, annotation)
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
         return model.objects.filter(user=request.user, recipe=obj).exists()
 
     def check_is_favorited(self, recipe):
-        return self.is_in_list(recipe, Favorite)
+        return self.is_in_list(recipe, Favorite, 'is_favorited')
 
     def check_is_in_shopping_cart(self, recipe):
-        return self.is_in_list(recipe, ShoppingCart)
+        return self.is_in_list(
+            recipe, ShoppingCart, 'is_in_shopping_cart'
+        )
+
+
+class RecipeMatchSerializer(ReadOnlyRecipeSerializer):
+    """Рецепт в подборе по имеющимся ингредиентам."""
+    matched = serializers.IntegerField(source='match.matched')
+    missing = serializers.IntegerField(source='match.missing')
+    jaccard = serializers.FloatField(source='match.jaccard')
+    missing_ingredients = serializers.ListField(
+        child=serializers.IntegerField()
+    )
+
+    class Meta(ReadOnlyRecipeSerializer.Meta):
+        fields = ReadOnlyRecipeSerializer.Meta.fields + [
+            'matched',
+            'missing',
+            'jaccard',
+            'missing_ingredients',
+        ]
+
+
+class PantrySerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=200,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = {
+                'ingredients': [
+                    value
+                    for values in data.getlist('ingredients')
+                    for value in values.split(',') if value
+                ],
+                **({'max_missing': data['max_missing']}
+                   if 'max_missing' in data else {}),
+            }
+        return super().to_internal_value(data)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления или удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=100,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
 
 
 class CreateOrUpdateRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор создания или изменения рецептов."""
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True)
+    tags = PrimaryKeyListField(queryset=Tag.objects.all())
     ingredients = CreateIngredientsAmountSerializer(
         many=True,
         source='ingredientamount')
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -154,26 +247,27 @@ class CreateOrUpdateRecipeSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    def validate_ingredients(self, ingredients):
+        """Подставляет ингредиенты, найденные одним запросом."""
+        resolved = resolve_primary_keys(
+            Ingredient.objects.all(),
+            [ingredient['id'] for ingredient in ingredients]
+        )
+        for ingredient, instance in zip(ingredients, resolved):
+            ingredient['id'] = instance
+        return ingredients
+
     def validate(self, data):
-        uniq_tags = []
-        uniq_ingredients = []
-        print(data)
-        for tag in data['tags']:
-            if tag.id in uniq_tags:
-                raise serializers.ValidationError(
-                    F'Тег {tag} повторяется')
-            uniq_tags.append(tag.id)
-        for ingredient in data['ingredientamount']:
-            ingredient_id = ingredient['id']
-            if ingredient_id in uniq_ingredients:
-                raise serializers.ValidationError(
-                    F'Ингредиент {ingredient} повторяется')
-            uniq_ingredients.append(ingredient_id)
-        if len(uniq_tags) == 0:
+        """Проверяет, что теги и ингредиенты не пусты, если переданы.
+
+        Повторы и несуществующие id отсекаются при разборе полей.
+        При частичном обновлении отсутствующие поля остаются прежними.
+        """
+        if 'tags' in data and not data['tags']:
             raise serializers.ValidationError(
                 'Добавление тегов обязательно!'
             )
-        if len(uniq_ingredients) == 0:
+        if 'ingredientamount' in data and not data['ingredientamount']:
             raise serializers.ValidationError(
                 'Добавление ингредиентов обязательно!'
             )
@@ -193,37 +287,128 @@ class CreateOrUpdateRecipeSerializer(serializers.ModelSerializer):
             ingredient_list.append(recipe_ingredient_object)
         IngredientAmount.objects.bulk_create(ingredient_list)
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredientamount')
         recipe = Recipe.objects.create(**validated_data)
+        change_counter(
+            User.objects.filter(pk=recipe.author_id), 'recipes_count', 1
+        )
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        update_search_vectors(Recipe.objects.filter(pk=recipe.pk))
+        self.save_image_variants(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        IngredientAmount.objects.filter(recipe=instance).delete()
-        instance.tags.set(validated_data.pop('tags'))
-        ingredients = validated_data.pop('ingredientamount')
-        self.create_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data.pop('tags'))
+        if 'ingredientamount' in validated_data:
+            self.update_ingredients(
+                instance, validated_data.pop('ingredientamount')
+            )
+        instance = super().update(instance, validated_data)
+        self.save_image_variants(instance)
+        return instance
+
+    def update_ingredients(self, recipe, ingredients):
+        """Приводит ингредиенты рецепта к ingredients.
+
+        Удаляет, изменяет и добавляет только отличающиеся строки,
+        итоги списков покупок меняются на разницу количеств.
+        """
+        current = {
+            row.ingredient_id: row
+            for row in IngredientAmount.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in current.items()
+        }
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = [
+            row.id for ingredient_id, row in current.items()
+            if ingredient_id not in new_amounts
+        ]
+        changed = []
+        created = []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            if row is None:
+                created.append(IngredientAmount(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                ))
+            elif row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if removed:
+            IngredientAmount.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ['amount'])
+        if created:
+            IngredientAmount.objects.bulk_create(created)
+        self.update_shopping_cart_totals(recipe, old_amounts, new_amounts)
+
+    def save_image_variants(self, recipe):
+        image = self.validated_data.get('image')
+        if isinstance(image, ProcessedImage):
+            recipe.image_variants = image.save_variants(recipe.image.name)
+            recipe.save(update_fields=['image_variants'])
+
+    def update_shopping_cart_totals(self, recipe, old_amounts, new_amounts):
+        deltas = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()
+        }
+        ShoppingCartTotal.objects.apply(
+            recipe.recipe_in_shopping_cart.values_list('user', flat=True),
+            deltas
+        )
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        if request is not None:
+            instance = Recipe.objects.with_user_flags(
+                request.user
+            ).get(pk=instance.pk)
         return ReadOnlyRecipeSerializer(
             instance,
             context={
-                'request': self.context.get('request')
+                'request': request
             }
         ).data
 
 
 class RecipePartInfoSerializer(serializers.ModelSerializer):
     """Сериализатор рецептов с минимальным количеством информации."""
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, recipe):
+        return image_variant_urls(recipe, self.context.get('request'))
+
+
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None, если он не задан."""
+    if request is None:
+        return None
+    try:
+        return max(int(request.query_params['recipes_limit']), 0)
+    except (KeyError, ValueError):
+        return None
 
 
 class FollowCreateSerializer(CustomUserSerializer):
@@ -243,6 +428,8 @@ class FollowCreateSerializer(CustomUserSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, follow):
+        if hasattr(follow, 'is_subscribed'):
+            return follow.is_subscribed
         current_user = self.context.get('request').user
         return Follow.objects.filter(
             author=follow.author,
@@ -250,7 +437,14 @@ class FollowCreateSerializer(CustomUserSerializer):
         ).exists()
 
     def get_recipes(self, follow):
-        queryset = Recipe.objects.filter(author=follow.author)
+        if hasattr(follow.author, 'latest_recipes'):
+            queryset = follow.author.latest_recipes
+        else:
+            queryset = Recipe.objects.filter(
+                author=follow.author
+            ).latest_per_author(
+                get_recipes_limit(self.context.get('request'))
+            )
         serializer = RecipePartInfoSerializer(
             queryset,
             read_only=True,
@@ -259,7 +453,7 @@ class FollowCreateSerializer(CustomUserSerializer):
         return serializer.data
 
     def get_recipes_count(self, follow):
-        return Recipe.objects.filter(author=follow.author).count()
+        return follow.author.recipes_count
 
 
 class FollowSerializer(serializers.ModelSerializer):
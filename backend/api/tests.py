@@ -0,0 +1,1104 @@
+import io
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.urls import resolve
+from django.test import SimpleTestCase, TestCase, override_settings
+from recipes.counters import change_counter, reconcile_counters
+from recipes.feed import publish
+from recipes.models import (
+    FeedEntry,
+    Favorite,
+    Ingredient,
+    IngredientAmount,
+    Recipe,
+    RecipeActivity,
+    RecipeRecommendations,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Tag,
+    TrendingRecipe,
+)
+from recipes.pantry import RecipeIngredientIndex
+from recipes.recommendations import build_recommendations
+from recipes.search import update_search_vectors
+from recipes.trending import update_activity, update_rankings
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from users.models import Follow
+
+from .fields import PrimaryKeyListField, resolve_primary_keys
+from .serializers import CreateOrUpdateRecipeSerializer
+from .renderers import PDFShoppingListRenderer
+
+User = get_user_model()
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password',
+        first_name=username,
+        last_name=username,
+    )
+
+
+def create_recipe(author, tags, ingredients, name, text='Текст', amount=1):
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        image='recipes/images/test.jpg',
+        text=text,
+        cooking_time=10,
+    )
+    recipe.tags.set(tags)
+    IngredientAmount.objects.bulk_create(
+        IngredientAmount(recipe=recipe, ingredient=ingredient, amount=amount)
+        for ingredient in ingredients
+    )
+    # Как сериализатор: ингредиенты добавлены после сохранения рецепта.
+    update_search_vectors(Recipe.objects.filter(pk=recipe.pk))
+    return recipe
+
+
+def create_recipes(author, tags, ingredients, count):
+    return [
+        create_recipe(author, tags, ingredients, f'{author.username} {number}')
+        for number in range(count)
+    ]
+
+
+@override_settings(ASYNC_DB_THREADS=0, IMAGE_PROCESS_WORKERS=0)
+class APITestCase(TestCase):
+    """Данные для тестов: два автора с рецептами и читатель."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        cls.reader = create_user('reader')
+        cls.authors = [create_user('author1'), create_user('author2')]
+        cls.recipes = []
+        for author in cls.authors:
+            cls.recipes += create_recipes(
+                author, cls.tags, cls.ingredients, 4
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipes[1])
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+
+class RoutingTests(SimpleTestCase):
+    """Маршрут асинхронной детальной страницы не перехватывает действия."""
+
+    def test_recipe_actions(self):
+        for path, url_name in (
+            ('download_shopping_cart', 'download-shopping-cart'),
+            ('favorite', 'favorite-bulk'),
+            ('feed', 'feed'),
+            ('match', 'match'),
+            ('shopping_cart', 'shopping-cart-bulk'),
+            ('trending', 'trending'),
+        ):
+            with self.subTest(path=path):
+                match = resolve(f'/api/recipes/{path}/')
+                self.assertEqual(match.url_name, f'recipe-{url_name}')
+
+    def test_recipe_detail(self):
+        match = resolve('/api/recipes/12/')
+        self.assertEqual(match.url_name, 'recipes-detail')
+        self.assertEqual(match.kwargs, {'pk': '12'})
+
+
+class PrimaryKeyFieldTests(TestCase):
+    """Проверка списков id одним запросом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color=f'#00000{index}', slug=f'tag{index}'
+            )
+            for index in range(3)
+        ]
+
+    def test_order(self):
+        ids = [self.tags[2].id, self.tags[0].id, self.tags[1].id]
+        with self.assertNumQueries(1):
+            resolved = resolve_primary_keys(Tag.objects.all(), ids)
+        self.assertEqual([tag.id for tag in resolved], ids)
+
+    def test_duplicates_and_missing(self):
+        first, second = self.tags[0].id, self.tags[1].id
+        missing = max(tag.id for tag in self.tags) + 1
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError) as context:
+                resolve_primary_keys(
+                    Tag.objects.all(),
+                    [first, second, first, missing, second, first]
+                )
+        self.assertEqual(
+            context.exception.detail,
+            [
+                f'Повторяются id: {first}, {second}.',
+                f'Не найдены id: {missing}.',
+            ]
+        )
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_primary_keys(Tag.objects.all(), []), [])
+
+    def test_field(self):
+        field = PrimaryKeyListField(queryset=Tag.objects.all())
+        ids = [tag.id for tag in reversed(self.tags)]
+        with self.assertNumQueries(1):
+            self.assertEqual(field.to_internal_value(ids), self.tags[::-1])
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValidationError):
+                field.to_internal_value(['abc'])
+
+
+class QueryCountTests(APITestCase):
+    """Число SQL-запросов не зависит от числа объектов в ответе."""
+
+    def assert_queries(self, client, url, number):
+        with self.assertNumQueries(number):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_recipes_list(self):
+        self.assert_queries(self.anonymous, '/api/recipes/', 6)
+        cache.clear()
+        response = self.assert_queries(self.client, '/api/recipes/', 6)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_recipes_list_cursor(self):
+        response = self.assert_queries(
+            self.client, '/api/recipes/?cursor=&limit=3', 6
+        )
+        self.assert_queries(self.client, response.data['next'], 5)
+
+    def test_recipes_list_not_modified(self):
+        response = self.client.get('/api/recipes/')
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/api/recipes/', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_recipe_detail(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        self.assert_queries(self.anonymous, url, 5)
+        response = self.assert_queries(self.client, url, 5)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+    def test_recipe_detail_not_modified(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_subscriptions(self):
+        response = self.assert_queries(
+            self.client, '/api/users/subscriptions/', 3
+        )
+        self.assertEqual(len(response.data['results']), 2)
+        self.assert_queries(
+            self.client, '/api/users/subscriptions/?recipes_limit=2', 3
+        )
+
+    def test_users(self):
+        self.assert_queries(self.client, '/api/users/', 1)
+        self.assert_queries(
+            self.client, f'/api/users/{self.authors[0].id}/', 1
+        )
+        self.assert_queries(self.client, '/api/users/me/', 1)
+
+    def test_ingredients(self):
+        self.assert_queries(self.anonymous, '/api/ingredients/', 1)
+        self.assert_queries(self.anonymous, '/api/ingredients/', 0)
+        self.assert_queries(
+            self.anonymous, '/api/ingredients/?name=ингр', 1
+        )
+
+    def test_tags(self):
+        self.assert_queries(self.anonymous, '/api/tags/', 1)
+        self.assert_queries(self.anonymous, '/api/tags/', 0)
+        self.assert_queries(
+            self.anonymous, f'/api/tags/{self.tags[0].id}/', 1
+        )
+
+
+class RecipeSearchTests(APITestCase):
+    """Поиск по рецептам и пагинация его результатов."""
+
+    def test_cursor_with_search(self):
+        response = self.client.get('/api/recipes/?search=author1&cursor=')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+
+    def test_search_pages(self):
+        response = self.client.get('/api/recipes/?search=author1&limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 4)
+        self.assertIsNotNone(response.data['next'])
+
+    def search(self, query, **params):
+        response = self.client.get(
+            '/api/recipes/', {'search': query, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_ranking(self):
+        lemon = Ingredient.objects.create(name='лимон', measurement_unit='шт')
+        author = self.authors[0]
+        in_text = create_recipe(
+            author, self.tags, self.ingredients[:1], 'Пирог',
+            text='Сверху лимон'
+        )
+        in_ingredients = create_recipe(author, self.tags, [lemon], 'Кекс')
+        in_name = create_recipe(
+            author, self.tags, self.ingredients[:1], 'Лимон в сахаре'
+        )
+        self.assertEqual(
+            self.search('лимон'),
+            [in_name.id, in_ingredients.id, in_text.id]
+        )
+
+    def test_ingredient_renamed(self):
+        self.assertEqual(self.search('шафран'), [])
+        self.ingredients[0].name = 'шафран'
+        self.ingredients[0].save()
+        self.assertEqual(len(self.search('шафран', limit=10)), 8)
+
+    def test_recipe_ingredients_changed(self):
+        lemon = Ingredient.objects.create(name='лимон', measurement_unit='шт')
+        recipe = self.recipes[0]
+        author = APIClient()
+        author.force_authenticate(recipe.author)
+        response = author.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': [{'id': lemon.id, 'amount': 2}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.search('лимон'), [recipe.id])
+        self.assertNotIn(
+            recipe.id, self.search(self.ingredients[0].name, limit=10)
+        )
+
+    def test_tag_renamed(self):
+        self.tags[0].slug = 'renamed'
+        self.tags[0].save()
+        self.assertEqual(
+            len(self.search('author1', tags='renamed', limit=10)), 4
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'морфология PostgreSQL')
+    def test_morphology(self):
+        recipe = create_recipe(
+            self.authors[0], self.tags, self.ingredients[:1], 'Лимон'
+        )
+        self.assertEqual(self.search('лимоны'), [recipe.id])
+
+
+class FeedTests(APITestCase):
+    """Лента подписок, заполненная по уже существующим подпискам."""
+
+    def feed_ids(self):
+        ids = []
+        url = '/api/recipes/feed/'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_rebuild_feed(self):
+        self.assertEqual(self.feed_ids(), [])
+        expected = sorted(
+            (recipe.created, recipe.id) for recipe in self.recipes
+        )
+        for _ in range(2):
+            call_command('rebuild_feed', stdout=io.StringIO())
+            self.assertEqual(
+                self.feed_ids(), [pk for _, pk in reversed(expected)]
+            )
+
+    def publish(self, author, queries):
+        recipe = create_recipe(author, self.tags, self.ingredients, 'Новый')
+        with self.assertNumQueries(queries):
+            with self.captureOnCommitCallbacks(execute=True):
+                publish(recipe)
+        return recipe
+
+    def test_publish_in_batches(self):
+        author = self.authors[0]
+        followers = [create_user(f'follower{number}') for number in range(4)]
+        Follow.objects.bulk_create(
+            Follow(user=user, author=author) for user in followers
+        )
+        reconcile_counters()
+        # Счётчик подписчиков и по три запроса на пачку из двух.
+        with mock.patch('recipes.feed.BATCH_SIZE', 2):
+            recipe = self.publish(author, 10)
+        self.assertEqual(
+            set(FeedEntry.objects.filter(recipe=recipe).values_list(
+                'user', flat=True
+            )),
+            {user.id for user in followers + [self.reader]}
+        )
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_popular_author(self):
+        reconcile_counters()
+        recipe = self.publish(self.authors[0], 1)
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe).exists())
+        self.assertEqual(self.feed_ids()[0], recipe.id)
+
+
+@override_settings(TRENDING_HALF_LIFE_HOURS=24, TRENDING_WINDOW_DAYS=14)
+class TrendingTests(APITestCase):
+    """Рейтинги популярных рецептов с подменённым текущим временем."""
+    now = datetime(2024, 5, 10, 12, tzinfo=timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        Favorite.objects.all().delete()
+        ShoppingCart.objects.all().delete()
+        self.users = [create_user(f'user{number}') for number in range(4)]
+
+    def at(self, moment):
+        return mock.patch('django.utils.timezone.now', return_value=moment)
+
+    def add(self, model, recipe, moment, count=1):
+        with self.at(moment):
+            for user in self.users[:count]:
+                model.objects.create(user=user, recipe=recipe)
+
+    def activity(self):
+        return {
+            (row.recipe_id, row.day): (row.favorites, row.carts)
+            for row in RecipeActivity.objects.all()
+        }
+
+    def test_activity(self):
+        recipe = self.recipes[2]
+        for action in ('favorite', 'shopping_cart'):
+            with self.at(self.now):
+                response = self.client.post(
+                    f'/api/recipes/{recipe.id}/{action}/'
+                )
+            self.assertEqual(response.status_code, 201)
+        self.add(Favorite, recipe, self.now - timedelta(days=1), count=2)
+        self.add(Favorite, self.recipes[3], self.now - timedelta(days=20))
+        update_activity(self.now)
+        today = self.now.date()
+        self.assertEqual(self.activity(), {
+            (recipe.id, today): (1, 1),
+            (recipe.id, today - timedelta(days=1)): (2, 0),
+        })
+
+        with self.at(self.now):
+            response = self.client.delete(
+                f'/api/recipes/{recipe.id}/favorite/'
+            )
+        self.assertEqual(response.status_code, 204)
+        update_activity(self.now)
+        self.assertEqual(self.activity()[recipe.id, today], (0, 1))
+
+    def test_scores(self):
+        older, fresh, yesterday = self.recipes[2:5]
+        # Середина суток позавчера - 48 часов назад: вклад 4 * 1/4.
+        self.add(Favorite, older, self.now - timedelta(days=2), count=4)
+        # Сегодняшние добавления - в середине прошедших 12 часов.
+        self.add(ShoppingCart, fresh, self.now)
+        self.add(Favorite, yesterday, self.now - timedelta(days=1))
+        update_activity(self.now)
+        update_rankings(self.now)
+        scores = dict(TrendingRecipe.objects.filter(
+            period=TrendingRecipe.TRENDING
+        ).values_list('recipe', 'score'))
+        self.assertAlmostEqual(scores[older.id], 1.0)
+        self.assertAlmostEqual(scores[fresh.id], 2 * 0.5 ** 0.25)
+        self.assertAlmostEqual(scores[yesterday.id], 0.5)
+        self.assertEqual(
+            list(TrendingRecipe.objects.filter(
+                period=TrendingRecipe.WEEK
+            ).values_list('recipe', 'score')),
+            [(older.id, 4.0), (fresh.id, 2.0), (yesterday.id, 1.0)]
+        )
+
+    def test_endpoint(self):
+        older, fresh, yesterday = self.recipes[2:5]
+        self.add(Favorite, older, self.now - timedelta(days=2), count=4)
+        self.add(ShoppingCart, fresh, self.now)
+        self.add(Favorite, yesterday, self.now - timedelta(days=1))
+        with self.at(self.now):
+            call_command('update_trending', stdout=io.StringIO())
+        for period, expected in (
+            ('trending', [fresh, older, yesterday]),
+            ('week', [older, fresh, yesterday]),
+        ):
+            with self.subTest(period=period):
+                response = self.anonymous.get(
+                    '/api/recipes/trending/', {'period': period}
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.data['results']],
+                    [recipe.id for recipe in expected]
+                )
+        response = self.anonymous.get(
+            '/api/recipes/trending/', {'period': 'year'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RecommendationTests(APITestCase):
+    """Похожие рецепты по совместным добавлениям."""
+
+    def setUp(self):
+        super().setUp()
+        Favorite.objects.all().delete()
+        ShoppingCart.objects.all().delete()
+        self.users = [create_user(f'user{number}') for number in range(4)]
+        self.first, self.second, self.third = self.recipes[:3]
+        # У каждого по два рецепта: вес пользователей одинаковый.
+        for user, recipes in (
+            (self.users[0], (self.first, self.second)),
+            (self.users[1], (self.first, self.second)),
+            (self.users[2], (self.first, self.third)),
+        ):
+            for recipe in recipes:
+                Favorite.objects.create(user=user, recipe=recipe)
+
+    def neighbors(self):
+        return {
+            row.recipe_id: list(zip(row.neighbors, row.scores))
+            for row in RecipeRecommendations.objects.all()
+        }
+
+    def test_cosine(self):
+        self.assertEqual(build_recommendations(10, full=True), 3)
+        neighbors = self.neighbors()
+        self.assertEqual(
+            [pk for pk, _ in neighbors[self.first.id]],
+            [self.second.id, self.third.id]
+        )
+        scores = [score for _, score in neighbors[self.first.id]]
+        self.assertAlmostEqual(scores[0], 2 / 6 ** 0.5, places=5)
+        self.assertAlmostEqual(scores[1], 1 / 3 ** 0.5, places=5)
+        # Второй и третий вместе не добавляли.
+        self.assertEqual(
+            [pk for pk, _ in neighbors[self.second.id]], [self.first.id]
+        )
+        self.assertEqual(
+            [pk for pk, _ in neighbors[self.third.id]], [self.first.id]
+        )
+        self.assertEqual(build_recommendations(1, full=True), 3)
+        self.assertEqual(
+            [pk for pk, _ in self.neighbors()[self.first.id]],
+            [self.second.id]
+        )
+
+    def test_incremental(self):
+        build_recommendations(10, full=True)
+        self.assertEqual(build_recommendations(10), 3)
+        with mock.patch(
+            'recipes.recommendations.SYNC_MARGIN', timedelta(0)
+        ):
+            self.assertEqual(build_recommendations(10), 0)
+            client = APIClient()
+            client.force_authenticate(self.users[3])
+            for recipe in (self.second, self.third):
+                response = client.post(
+                    f'/api/recipes/{recipe.id}/shopping_cart/'
+                )
+                self.assertEqual(response.status_code, 201)
+            self.assertEqual(build_recommendations(10), 2)
+        self.assertIn(
+            self.third.id,
+            [pk for pk, _ in self.neighbors()[self.second.id]]
+        )
+
+    def test_backdated(self):
+        build_recommendations(10, full=True)
+        fourth = self.recipes[3]
+        Favorite.objects.create(user=self.users[0], recipe=fourth)
+        Favorite.objects.filter(recipe=fourth).update(
+            created=datetime(2020, 1, 1, tzinfo=timezone.utc)
+        )
+        with mock.patch(
+            'recipes.recommendations.SYNC_MARGIN', timedelta(0)
+        ):
+            self.assertEqual(build_recommendations(10), 3)
+        self.assertIn(
+            fourth.id, [pk for pk, _ in self.neighbors()[self.first.id]]
+        )
+
+    def test_endpoint(self):
+        build_recommendations(10, full=True)
+        response = self.anonymous.get(
+            f'/api/recipes/{self.first.id}/recommendations/'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data],
+            [self.second.id, self.third.id]
+        )
+
+    def test_endpoint_fallback(self):
+        build_recommendations(10, full=True)
+        reconcile_counters()
+        recipe = self.recipes[5]
+        with self.settings(RECOMMENDATIONS_SIZE=3):
+            response = self.anonymous.get(
+                f'/api/recipes/{recipe.id}/recommendations/'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data],
+            [self.first.id, self.second.id, self.third.id]
+        )
+        response = self.anonymous.get('/api/recipes/0/recommendations/')
+        self.assertEqual(response.status_code, 404)
+
+
+class RecipeMatchTests(APITestCase):
+    """Подбор рецептов по имеющимся ингредиентам."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(
+            'api.views.recipe_ingredient_index', RecipeIngredientIndex()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        author = self.authors[0]
+        self.pantry = [
+            Ingredient.objects.create(
+                name=f'Запас {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        first, second, third, fourth = self.pantry
+        self.full = create_recipe(author, self.tags, [first, second], 'Всё')
+        self.one_missing = create_recipe(
+            author, self.tags, [first, second, third], 'Без одного'
+        )
+        self.partial = create_recipe(
+            author, self.tags, [first, third], 'Половина'
+        )
+        self.two_missing = create_recipe(
+            author, self.tags, [first, third, fourth], 'Без двух'
+        )
+        self.unrelated = create_recipe(author, self.tags, [third], 'Другое')
+
+    def match(self, *ingredients, **params):
+        response = self.anonymous.get('/api/recipes/match/', {
+            'ingredients': ','.join(
+                str(ingredient.id) for ingredient in ingredients
+            ),
+            **params,
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['results']
+
+    def test_ranking(self):
+        results = self.match(*self.pantry[:2])
+        self.assertEqual(
+            [recipe['id'] for recipe in results],
+            [
+                self.full.id,
+                self.one_missing.id,
+                self.partial.id,
+                self.two_missing.id,
+            ]
+        )
+        self.assertEqual(
+            [(recipe['matched'], recipe['missing']) for recipe in results],
+            [(2, 0), (2, 1), (1, 1), (1, 2)]
+        )
+        self.assertEqual(results[0]['jaccard'], 1)
+        self.assertAlmostEqual(results[1]['jaccard'], 2 / 3)
+        self.assertEqual(results[0]['missing_ingredients'], [])
+        self.assertEqual(
+            results[3]['missing_ingredients'],
+            sorted([self.pantry[2].id, self.pantry[3].id])
+        )
+
+    def test_max_missing(self):
+        results = self.match(*self.pantry[:2], max_missing=0)
+        self.assertEqual([recipe['id'] for recipe in results], [self.full.id])
+        results = self.match(*self.pantry[:2], max_missing=1)
+        self.assertNotIn(
+            self.two_missing.id, [recipe['id'] for recipe in results]
+        )
+
+    def test_ingredients_changed(self):
+        self.assertNotIn(
+            self.unrelated.id,
+            [recipe['id'] for recipe in self.match(*self.pantry[:2])]
+        )
+        author = APIClient()
+        author.force_authenticate(self.unrelated.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = author.patch(
+                f'/api/recipes/{self.unrelated.id}/',
+                {'ingredients': [
+                    {'id': ingredient.id, 'amount': 1}
+                    for ingredient in self.pantry[:2]
+                ]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        results = self.match(*self.pantry[:2])
+        self.assertEqual(
+            {recipe['id'] for recipe in results if not recipe['missing']},
+            {self.full.id, self.unrelated.id}
+        )
+
+
+class RecipeUpdateTests(APITestCase):
+    """Изменение рецепта: PATCH частичный, ингредиенты меняются разницей."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[1]
+        self.author = APIClient()
+        self.author.force_authenticate(self.recipe.author)
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def ingredient_amounts(self):
+        return dict(IngredientAmount.objects.filter(
+            recipe=self.recipe
+        ).values_list('ingredient_id', 'amount'))
+
+    def test_patch_keeps_omitted_fields(self):
+        amounts = self.ingredient_amounts()
+        response = self.author.patch(
+            self.url, {'name': 'Новое название'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(self.recipe.image.name, 'recipes/images/test.jpg')
+        self.assertEqual(self.ingredient_amounts(), amounts)
+        self.assertEqual(
+            set(self.recipe.tags.values_list('id', flat=True)),
+            {tag.id for tag in self.tags}
+        )
+
+    def test_ingredients_update_cart_totals(self):
+        other = create_user('other')
+        ShoppingCart.objects.create(user=other, recipe=self.recipe)
+        ShoppingCartTotal.objects.add_recipes(
+            [self.reader.id, other.id], [self.recipe]
+        )
+        added = Ingredient.objects.create(name='Новый', measurement_unit='г')
+        kept, changed, removed = self.ingredients[0], *self.ingredients[1:3]
+        expected = {kept.id: 1, changed.id: 5, added.id: 3}
+        response = self.author.patch(
+            self.url,
+            {
+                'ingredients': [
+                    {'id': pk, 'amount': amount}
+                    for pk, amount in expected.items()
+                ]
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.ingredient_amounts(), expected)
+        self.assertNotIn(removed.id, self.ingredient_amounts())
+        for user in (self.reader, other):
+            self.assertEqual(
+                dict(ShoppingCartTotal.objects.filter(
+                    user=user
+                ).values_list('ingredient_id', 'amount')),
+                expected
+            )
+        call_command(
+            'rebuild_shopping_cart_totals', '--check', stdout=io.StringIO()
+        )
+
+    def test_put_requires_fields(self):
+        response = self.author.put(
+            self.url, {'name': 'Новое название'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        for field in ('tags', 'ingredients', 'image', 'text'):
+            self.assertIn(field, response.data)
+        self.recipe.refresh_from_db()
+        self.assertNotEqual(self.recipe.name, 'Новое название')
+
+
+class RecipeActionTests(APITestCase):
+    """Добавление и удаление рецептов под блокировкой пользователя.
+
+    В тестах transaction.atomic добавляет SAVEPOINT и RELEASE: добавление
+    в избранное вне теста - 4 запроса.
+    """
+
+    def assert_queries(self, method, url, number, status, data=None):
+        with self.assertNumQueries(number):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, status, response.data)
+        return response
+
+    def test_favorite(self):
+        recipe = self.recipes[2]
+        url = f'/api/recipes/{recipe.id}/favorite/'
+        self.assert_queries('post', url, 6, 201)
+        self.assert_queries('post', url, 6, 400)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assert_queries('delete', url, 6, 204)
+        self.assert_queries('delete', url, 5, 400)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+    def test_shopping_cart(self):
+        recipe = self.recipes[2]
+        url = f'/api/recipes/{recipe.id}/shopping_cart/'
+        self.assert_queries('post', url, 10, 201)
+        self.assert_queries('post', url, 6, 400)
+        self.assertEqual(
+            ShoppingCartTotal.objects.filter(user=self.reader).count(), 4
+        )
+        self.assert_queries('delete', url, 10, 204)
+        self.assert_queries('delete', url, 5, 400)
+        self.assertFalse(
+            ShoppingCartTotal.objects.filter(user=self.reader).exists()
+        )
+
+    def test_bulk(self):
+        ids = [recipe.id for recipe in self.recipes[2:6]]
+        for url, number in (
+            ('/api/recipes/favorite/', 6),
+            ('/api/recipes/shopping_cart/', 10),
+        ):
+            with self.subTest(url=url):
+                response = self.assert_queries(
+                    'post', url, number, 200, {'recipes': ids}
+                )
+                self.assertEqual(
+                    {item['status'] for item in response.data['recipes']},
+                    {'added'}
+                )
+                self.assert_queries(
+                    'delete', url, number, 200, {'recipes': ids}
+                )
+
+    def test_single_and_bulk(self):
+        recipe = self.recipes[2]
+        for action, field in (
+            ('favorite', 'favorites_count'),
+            ('shopping_cart', 'shopping_cart_count'),
+        ):
+            with self.subTest(action=action):
+                single = f'/api/recipes/{recipe.id}/{action}/'
+                bulk = f'/api/recipes/{action}/'
+                data = {'recipes': [recipe.id]}
+                self.client.post(single)
+                response = self.client.post(bulk, data, format='json')
+                self.assertEqual(
+                    response.data['recipes'][0]['status'], 'already_added'
+                )
+                self.client.delete(bulk, data, format='json')
+                response = self.client.delete(single)
+                self.assertEqual(response.status_code, 400)
+                response = self.client.delete(bulk, data, format='json')
+                self.assertEqual(
+                    response.data['recipes'][0]['status'], 'not_added'
+                )
+                self.client.post(bulk, data, format='json')
+                response = self.client.post(single)
+                self.assertEqual(response.status_code, 400)
+                recipe.refresh_from_db()
+                self.assertEqual(getattr(recipe, field), 1)
+        self.assertEqual(
+            dict(ShoppingCartTotal.objects.filter(
+                user=self.reader
+            ).values_list('ingredient_id', 'amount')),
+            {ingredient.id: 1 for ingredient in self.ingredients}
+        )
+
+
+class CounterTests(APITestCase):
+    """Денормализованные счётчики избранного, корзины и подписчиков."""
+
+    def setUp(self):
+        super().setUp()
+        # Данные setUpTestData созданы в обход счётчиков.
+        reconcile_counters()
+
+    def test_stale_recipe_save(self):
+        stale = Recipe.objects.get(pk=self.recipes[2].pk)
+        for action in ('favorite', 'shopping_cart'):
+            response = self.client.post(
+                f'/api/recipes/{stale.id}/{action}/'
+            )
+            self.assertEqual(response.status_code, 201)
+        serializer = CreateOrUpdateRecipeSerializer(
+            stale, data={'name': 'Новое название'}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        recipe = Recipe.objects.get(pk=stale.pk)
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count), (1, 1)
+        )
+
+    def test_stale_user_save(self):
+        author = self.authors[0]
+        stale = User.objects.get(pk=author.pk)
+        follower = create_user('follower')
+        client = APIClient()
+        client.force_authenticate(follower)
+        response = client.post(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        stale.first_name = 'Новое имя'
+        stale.save()
+        author.refresh_from_db()
+        self.assertEqual(author.first_name, 'Новое имя')
+        self.assertEqual(
+            (author.recipes_count, author.followers_count), (4, 2)
+        )
+
+    def test_new_objects_are_inserted(self):
+        user = User(username='new', email='new@example.com')
+        user.save()
+        self.assertEqual(user.followers_count, 0)
+        self.assertTrue(User.objects.filter(username='new').exists())
+
+    def test_reconcile(self):
+        recipe = self.recipes[0]
+        change_counter(
+            Recipe.objects.filter(pk=recipe.pk), 'favorites_count', 5
+        )
+        change_counter(
+            User.objects.filter(pk=self.authors[1].pk), 'followers_count', -1
+        )
+        with self.assertRaises(CommandError):
+            call_command('reconcile_counters', '--check', stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 6)
+
+        stdout = io.StringIO()
+        call_command('reconcile_counters', stdout=stdout)
+        self.assertIn('Исправлено: 2!', stdout.getvalue())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.authors[1].refresh_from_db()
+        self.assertEqual(self.authors[1].followers_count, 1)
+
+        stdout = io.StringIO()
+        call_command('reconcile_counters', '--check', stdout=stdout)
+        self.assertIn('Счётчики совпадают!', stdout.getvalue())
+
+    def test_popular_ordering(self):
+        other = APIClient()
+        other.force_authenticate(create_user('other'))
+        for client, recipe in (
+            (self.client, self.recipes[3]),
+            (self.client, self.recipes[5]),
+            (other, self.recipes[5]),
+        ):
+            response = client.post(f'/api/recipes/{recipe.id}/favorite/')
+            self.assertEqual(response.status_code, 201)
+        response = self.anonymous.get(
+            '/api/recipes/', {'ordering': 'popular', 'limit': 10}
+        )
+        self.assertEqual(response.status_code, 200)
+        expected = sorted(
+            Recipe.objects.all(),
+            key=lambda recipe: (
+                -recipe.favorites_count, -recipe.created.timestamp(), recipe.id
+            )
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [recipe.id for recipe in expected]
+        )
+        self.assertEqual(response.data['results'][0]['id'], self.recipes[5].id)
+        self.assertEqual(
+            {recipe['id'] for recipe in response.data['results'][1:3]},
+            {self.recipes[0].id, self.recipes[3].id}
+        )
+
+
+class ConditionalRecipeTests(APITestCase):
+    """ETag рецептов меняется вместе со всем, что входит в ответ."""
+
+    def assert_changed(self, url, change):
+        response = self.client.get(url)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipes[0].id}/'):
+            response = self.client.get(url)
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+            self.assertEqual(response.status_code, 304)
+
+    def test_tag_renamed(self):
+        def rename():
+            self.tags[0].name = 'Новое имя'
+            self.tags[0].save()
+        self.assert_changed(f'/api/recipes/{self.recipes[0].id}/', rename)
+
+    def test_ingredient_renamed(self):
+        def rename():
+            self.ingredients[0].name = 'Новое имя'
+            self.ingredients[0].save()
+        self.assert_changed('/api/recipes/', rename)
+
+    def test_author_changed(self):
+        def rename():
+            self.authors[0].first_name = 'Новое имя'
+            self.authors[0].save()
+        self.assert_changed(f'/api/recipes/{self.recipes[0].id}/', rename)
+
+    def test_anonymous_last_modified(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        response = self.anonymous.get(url)
+        # Last-Modified с точностью до секунды.
+        later = time.time_ns() + 2 * 10 ** 9
+        with mock.patch('recipes.cache.time.time_ns', return_value=later):
+            self.tags[0].save()
+        response = self.anonymous.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ShoppingListTests(APITestCase):
+    """Выгрузка списка покупок в PDF."""
+
+    def test_pdf(self):
+        ShoppingCartTotal.objects.add_recipes(
+            [self.reader.id], [self.recipes[1]]
+        )
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=pdf'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('shopping_list.pdf', response['Content-Disposition'])
+        body = b''.join(response.streaming_content)
+        self.assertTrue(body.startswith(b'%PDF-'))
+        self.assertIn(b'%%EOF', body[-16:])
+
+    @override_settings(SHOPPING_LIST_PDF_FONT='')
+    def test_pdf_pages(self):
+        rows = [
+            {
+                'ingredient__name': f'flour {number}',
+                'ingredient__measurement_unit': 'g',
+                'ingredient_total': number,
+            }
+            for number in range(100)
+        ]
+        body = b''.join(PDFShoppingListRenderer().stream(rows))
+        self.assertIn(b'/Count 3', body)
+
+
+class ASGITests(APITestCase):
+    """Запросы через ASGI-приложение, как под uvicorn."""
+
+    def asgi_get(self, path, query_string=''):
+        token, _ = Token.objects.get_or_create(user=self.reader)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query_string.encode(),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'Token {token.key}'.encode()),
+            ],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 5000),
+        }
+
+        async def request():
+            communicator = ApplicationCommunicator(
+                get_asgi_application(), scope
+            )
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(timeout=5)
+            body = b''
+            while True:
+                message = await communicator.receive_output(timeout=5)
+                body += message.get('body', b'')
+                if not message.get('more_body'):
+                    break
+            await communicator.wait()
+            return start['status'], body
+
+        # Как и тестовый клиент, не закрываем соединение теста с БД.
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            return async_to_sync(request)()
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    def test_download_shopping_cart(self):
+        ShoppingCartTotal.objects.add_recipes(
+            [self.reader.id], [self.recipes[1]]
+        )
+        for file_format in ('txt', 'csv'):
+            status, body = self.asgi_get(
+                '/api/recipes/download_shopping_cart/',
+                f'format={file_format}'
+            )
+            self.assertEqual(status, 200)
+            self.assertIn(self.ingredients[0].name, body.decode())
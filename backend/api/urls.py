@@ -1,7 +1,9 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework import routers
 
+from .async_views import async_read_view
 from .views import (
+    CustomUserViewSet,
     IngredientViewSet,
     TagViewSet,
     RecipesViewSet,
@@ -13,9 +15,34 @@ router = routers.DefaultRouter()
 router.register('tags', TagViewSet)
 router.register('recipes', RecipesViewSet)
 router.register('ingredients', IngredientViewSet)
+router.register('users', CustomUserViewSet)
+
+recipe_list = RecipesViewSet.as_view({'get': 'list', 'post': 'create'})
+recipe_detail = RecipesViewSet.as_view({
+    'get': 'retrieve',
+    'put': 'update',
+    'patch': 'partial_update',
+    'delete': 'destroy',
+})
+ingredient_list = IngredientViewSet.as_view({'get': 'list'})
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
+    path(
+        'recipes/',
+        async_read_view(recipe_list),
+        name='recipes-list'
+    ),
+    re_path(
+        r'^recipes/(?P<pk>\d+)/$',
+        async_read_view(recipe_detail),
+        name='recipes-detail'
+    ),
+    path(
+        'ingredients/',
+        async_read_view(ingredient_list),
+        name='ingredients-list'
+    ),
     path(
         'users/<int:users_id>/subscribe/', FollowViewSet.as_view(
             {
@@ -26,9 +53,8 @@ urlpatterns = [
     ),
     path(
         'users/subscriptions/',
-        ListOnlyFollowsAPIView.as_view(),
+        async_read_view(ListOnlyFollowsAPIView.as_view()),
         name='users-follow'
     ),
-    path('', include('djoser.urls')),
     path('', include(router.urls)),
 ]
@@ -1,23 +1,31 @@
-import csv
-
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, )
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import status, viewsets, permissions, mixins
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.permissions import (SAFE_METHODS, AllowAny,
                                         IsAuthenticated, )
 from rest_framework.decorators import action
+from djoser.views import UserViewSet
+from foodgram.metrics import SerializerMetricsMixin, serializer_data
 from .serializers import (
     IngredientSerializer,
     CreateOrUpdateRecipeSerializer,
+    PantrySerializer,
     ReadOnlyRecipeSerializer,
+    RecipeIdsSerializer,
+    RecipeMatchSerializer,
     TagSerializer,
     FollowSerializer,
     RecipePartInfoSerializer,
-    FollowCreateSerializer
+    FollowCreateSerializer,
+    get_recipes_limit,
 )
 from recipes.models import (
     Ingredient,
@@ -25,26 +33,66 @@ from recipes.models import (
     Tag,
     ShoppingCart,
     Favorite,
-    IngredientAmount
+    RecipeRecommendations,
+    ShoppingCartTotal,
+    TrendingRecipe,
 )
-from users.models import Follow
+from recipes.cache import INGREDIENTS, TAGS
+from recipes.counters import change_counter
+from recipes.feed import follow, publish, read_feed, unfollow
+from recipes.pantry import recipe_ingredient_index
+from recipes.search import highlight_recipes, ingredient_index
+from users.models import Follow, with_is_subscribed
 
-from .pagination import CustomPagination
-from .filter import IngredientFilter, TagFilter
+from .cache import CachedResponseMixin, ConditionalRecipeMixin
+from .pagination import CustomPagination, FeedPagination, KeysetPagination
+from .renderers import SHOPPING_LIST_RENDERERS
+from .filter import POPULAR, POPULAR_ORDERING, IngredientFilter, TagFilter
 from .permissions import AuthorIsRequestUserPermission
 
 User = get_user_model()
 
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'shopping_cart_count',
+}
+
+# Статусы рецептов в ответах массового добавления и удаления.
+ADDED = 'added'
+ALREADY_ADDED = 'already_added'
+REMOVED = 'removed'
+NOT_ADDED = 'not_added'
+NOT_FOUND = 'not_found'
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    CachedResponseMixin,
+    SerializerMetricsMixin,
+    viewsets.ReadOnlyModelViewSet
+):
     """Вью для работы с ингредиентами."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = [AllowAny, ]
     filterset_class = IngredientFilter
+    cache_version_name = INGREDIENTS
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('name'):
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.search, request)
+
+    def search(self, request):
+        serializer = self.get_serializer(
+            ingredient_index.search(request.query_params['name']),
+            many=True
+        )
+        return Response(serializer_data(serializer))
 
 
 class TagViewSet(
+    CachedResponseMixin,
+    SerializerMetricsMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet
@@ -53,9 +101,14 @@ class TagViewSet(
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    cache_version_name = TAGS
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(
+    ConditionalRecipeMixin,
+    SerializerMetricsMixin,
+    viewsets.ModelViewSet
+):
     """Вью для Рецепта."""
 
     queryset = Recipe.objects.all()
@@ -64,35 +117,72 @@ class RecipesViewSet(viewsets.ModelViewSet):
     filterset_class = TagFilter
     pagination_class = CustomPagination
 
+    @property
+    def keyset_ordering(self):
+        if self.request.query_params.get('ordering') == POPULAR:
+            return POPULAR_ORDERING
+        return ('-created', 'id')
+
+    def paginate_queryset(self, queryset):
+        # Результаты поиска упорядочены по рангу, курсор по keyset_ordering
+        # перемешал бы их.
+        if (
+            KeysetPagination.cursor_query_param in self.request.query_params
+            and self.request.query_params.get('search', '').strip()
+        ):
+            raise ValidationError({
+                KeysetPagination.cursor_query_param: [
+                    'Курсор нельзя использовать вместе с search, '
+                    'используйте page.'
+                ]
+            })
+        return super().paginate_queryset(queryset)
+
+    def get_queryset(self):
+        return Recipe.objects.with_user_flags(self.request.user)
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return ReadOnlyRecipeSerializer
         return CreateOrUpdateRecipeSerializer
 
+    def prepare_page(self, recipes):
+        query = self.request.query_params.get('search', '').strip()
+        if query:
+            highlight_recipes(recipes, query)
+        return recipes
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
-
-    def create_csv_file(self, ingredients):
-        response = HttpResponse(
-            content_type='text/csv',
-            headers={
-                'Content-Disposition': 'attachment; '
-                + 'filename="shopping_list.csv"'
-            },
-            status=status.HTTP_201_CREATED
-        )
-        ingredients = list(ingredients)
-
-        writer = csv.DictWriter(
-            response,
-            fieldnames=[
-                'ingredient__name',
-                'ingredient__measurement_unit',
-                'ingredient_total'
-            ],
-        )
-        for row in ingredients:
-            writer.writerow(row)
+        publish(serializer.save(author=self.request.user))
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingCartTotal.objects.remove_recipes(
+            instance.recipe_in_shopping_cart.values_list('user', flat=True),
+            [instance]
+        )
+        instance.delete()
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', -1
+        )
+
+    def stream_shopping_list(self, ingredients):
+        renderer = self.request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        # Под ASGI Django 3.2 перебирает StreamingHttpResponse в event
+        # loop, где к БД обращаться нельзя, поэтому строки читаются здесь,
+        # в потоке представления. Список мал по построению: итоги хранят
+        # одну строку на ингредиент. По частям отдаётся сборка файла.
+        rows = list(ingredients)
+        response = StreamingHttpResponse(
+            renderer.stream(rows),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
         return response
 
     @action(
@@ -115,43 +205,267 @@ class RecipesViewSet(viewsets.ModelViewSet):
             return self.add_recipe(ShoppingCart, pk=pk)
         return self.remove_recipe(ShoppingCart, pk=pk)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        permission_classes=[permissions.IsAuthenticated, ]
+    )
+    def favorite_bulk(self, request):
+        """Добавление или удаление в избранное списка рецептов."""
+        return self.change_recipes_bulk(Favorite)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        permission_classes=[permissions.IsAuthenticated, ]
+    )
+    def shopping_cart_bulk(self, request):
+        """Добавление или удаление в список покупок списка рецептов."""
+        return self.change_recipes_bulk(ShoppingCart)
+
     @action(
         detail=False,
         methods=['get', ],
         permission_classes=[permissions.IsAuthenticated, ]
     )
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые первыми, курсор cursor."""
+        paginator = FeedPagination()
+        page = paginator.paginate_feed(
+            lambda position, limit: read_feed(
+                request.user.id, position, limit
+            ),
+            request,
+            Recipe
+        )
+        recipes = self.get_queryset().in_bulk([entry.id for entry in page])
+        serializer = ReadOnlyRecipeSerializer(
+            [recipes[entry.id] for entry in page if entry.id in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(
+            serializer_data(serializer)
+        )
+
+    @action(detail=True, methods=['get', ])
+    def recommendations(self, request, pk):
+        """Рецепты, которые добавляют вместе с этим.
+
+        Список соседей берётся одной строкой, построенной командой
+        build_recommendations. Для рецептов без совместных добавлений -
+        популярные рецепты.
+        """
+        ids = RecipeRecommendations.objects.filter(recipe=pk).values_list(
+            'neighbors', flat=True
+        ).first()
+        if ids is None:
+            get_object_or_404(Recipe, pk=pk)
+        if not ids:
+            ids = list(Recipe.objects.exclude(pk=pk).order_by(
+                *POPULAR_ORDERING
+            ).values_list('id', flat=True)[:settings.RECOMMENDATIONS_SIZE])
+        recipes = Recipe.objects.in_bulk(ids)
+        serializer = RecipePartInfoSerializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return Response(serializer_data(serializer))
+
+    @action(detail=False, methods=['get', ])
+    def trending(self, request):
+        """Готовый рейтинг рецептов, period: trending (по умолчанию), week.
+
+        Рейтинг пересчитывает команда update_trending.
+        """
+        period = request.query_params.get('period', TrendingRecipe.TRENDING)
+        if period not in dict(TrendingRecipe.PERIODS):
+            return Response(
+                data={'errors': f'Неизвестный рейтинг: {period}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        ids = self.paginator.paginate_queryset(
+            TrendingRecipe.objects.filter(period=period).values_list(
+                'recipe', flat=True
+            ),
+            request
+        )
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = ReadOnlyRecipeSerializer(
+            [recipes[pk] for pk in ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return self.paginator.get_paginated_response(
+            serializer_data(serializer)
+        )
+
+    @action(detail=False, methods=['get', ], url_path='match')
+    def match(self, request):
+        """Рецепты по имеющимся ингредиентам.
+
+        ?ingredients=1,2,3 (или повторяющийся параметр), max_missing -
+        наибольшее число недостающих ингредиентов. Сначала рецепты,
+        где недостаёт меньше, затем по коэффициенту Жаккара.
+        """
+        params = PantrySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        pantry = params.validated_data['ingredients']
+        matches = recipe_ingredient_index.match(
+            pantry, params.validated_data.get('max_missing')
+        )
+        page = self.paginator.paginate_queryset(matches, request)
+        recipes = self.get_queryset().in_bulk(
+            [match.recipe_id for match in page]
+        )
+        result = []
+        for match in page:
+            recipe = recipes.get(match.recipe_id)
+            if recipe is None:
+                continue
+            recipe.match = match
+            recipe.missing_ingredients = (
+                recipe_ingredient_index.missing_ingredients(
+                    match.recipe_id, pantry
+                )
+            )
+            result.append(recipe)
+        serializer = RecipeMatchSerializer(
+            result, many=True, context=self.get_serializer_context()
+        )
+        return self.paginator.get_paginated_response(
+            serializer_data(serializer)
+        )
+
+    @action(
+        detail=False,
+        methods=['get', ],
+        permission_classes=[permissions.IsAuthenticated, ],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+    )
     def download_shopping_cart(self, request):
-        ingredients = IngredientAmount.objects.filter(
-            recipe__recipe_in_shopping_cart__user=request.user
+        ingredients = ShoppingCartTotal.objects.filter(
+            user=request.user
         ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            ingredient_total=F('amount'),
         ).order_by(
             'ingredient__name'
-        ).annotate(
-            ingredient_total=Sum('amount')
         )
-        return self.create_csv_file(ingredients)
+        return self.stream_shopping_list(ingredients)
+
+    def lock_user(self, user):
+        """Блокирует строку пользователя до конца транзакции.
+
+        Под этой блокировкой идут все изменения избранного и списка
+        покупок пользователя, одиночные и массовые, поэтому параллельные
+        запросы не учтут одно добавление дважды в счётчиках и итогах.
+        """
+        list(User.objects.select_for_update().filter(
+            pk=user.pk
+        ).values_list('pk'))
+
+    def change_recipes(self, throughmodel, recipe_ids, add):
+        """Добавляет или удаляет рецепты пользователя, {id: статус}."""
+        user = self.request.user
+        with transaction.atomic():
+            self.lock_user(user)
+            added = dict(Recipe.objects.filter(
+                pk__in=recipe_ids
+            ).order_by().annotate(
+                added=Exists(throughmodel.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                ))
+            ).values_list('pk', 'added'))
+            changed = [pk for pk, is_added in added.items() if is_added != add]
+            if changed and add:
+                throughmodel.objects.bulk_create(
+                    [throughmodel(user=user, recipe_id=pk) for pk in changed],
+                    ignore_conflicts=True,
+                )
+            elif changed:
+                throughmodel.objects.filter(
+                    user=user, recipe_id__in=changed
+                ).delete()
+            if changed:
+                change_counter(
+                    Recipe.objects.filter(pk__in=changed),
+                    RECIPE_COUNTERS[throughmodel], 1 if add else -1
+                )
+            if changed and throughmodel is ShoppingCart:
+                totals = ShoppingCartTotal.objects
+                change_totals = (
+                    totals.add_recipes if add else totals.remove_recipes
+                )
+                change_totals([user.id], changed)
+        statuses = {}
+        for pk in recipe_ids:
+            if pk not in added:
+                statuses[pk] = NOT_FOUND
+            elif added[pk] == add:
+                statuses[pk] = ALREADY_ADDED if add else NOT_ADDED
+            else:
+                statuses[pk] = ADDED if add else REMOVED
+        return statuses
+
+    def change_recipes_bulk(self, throughmodel):
+        serializer = RecipeIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        statuses = self.change_recipes(
+            throughmodel,
+            serializer.validated_data['recipes'],
+            add=self.request.method == 'POST',
+        )
+        return Response(data={
+            'recipes': [
+                {'id': pk, 'status': recipe_status}
+                for pk, recipe_status in statuses.items()
+            ]
+        })
 
     def add_recipe(self, throughmodel, pk):
+        """Добавление одного рецепта, повтор отсекает уникальность."""
         recipe = get_object_or_404(Recipe, pk=pk)
         user = self.request.user
-        if throughmodel.objects.filter(recipe=recipe, user=user).exists():
+        try:
+            with transaction.atomic():
+                self.lock_user(user)
+                throughmodel.objects.create(recipe=recipe, user=user)
+                change_counter(
+                    Recipe.objects.filter(pk=recipe.pk),
+                    RECIPE_COUNTERS[throughmodel], 1
+                )
+                if throughmodel is ShoppingCart:
+                    ShoppingCartTotal.objects.add_recipes([user.id], [recipe])
+        except IntegrityError:
             return Response(
                 data={'errors': 'Рецепт уже добавлен!'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        throughmodel.objects.create(recipe=recipe, user=user)
         serializer = RecipePartInfoSerializer(recipe)
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
     def remove_recipe(self, throughmodel, pk):
+        """Удаление одного рецепта, изменения по числу удалённых строк."""
         recipe = get_object_or_404(Recipe, pk=pk)
         user = self.request.user
-        instance = throughmodel.objects.filter(
-            recipe=recipe,
-            user=user
-        )
-        if not instance.exists():
+        with transaction.atomic():
+            self.lock_user(user)
+            deleted, _ = throughmodel.objects.filter(
+                recipe=recipe, user=user
+            ).delete()
+            if deleted:
+                change_counter(
+                    Recipe.objects.filter(pk=recipe.pk),
+                    RECIPE_COUNTERS[throughmodel], -deleted
+                )
+            if deleted and throughmodel is ShoppingCart:
+                ShoppingCartTotal.objects.remove_recipes([user.id], [recipe])
+        if not deleted:
             return Response(
                 data={
                     'errors': 'Нельзя удалить рецепт, '
@@ -159,19 +473,34 @@ class RecipesViewSet(viewsets.ModelViewSet):
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
-        instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ListOnlyFollowsAPIView(ListAPIView):
+class CustomUserViewSet(SerializerMetricsMixin, UserViewSet):
+    """Пользователи djoser с флагом подписки, вычисленным в запросе."""
+
+    def get_queryset(self):
+        return with_is_subscribed(super().get_queryset(), self.request.user)
+
+
+class ListOnlyFollowsAPIView(SerializerMetricsMixin, ListAPIView):
     """Вью для просмотра подписок."""
     serializer_class = FollowCreateSerializer
     permission_classes = [IsAuthenticated, ]
     pagination_class = CustomPagination
+    keyset_ordering = ('-id', )
 
     def get_queryset(self):
         user = self.request.user
-        return user.follower.all()
+        return user.follower.select_related('author').annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('-id').prefetch_related(Prefetch(
+            'author__creator',
+            queryset=Recipe.objects.latest_per_author(
+                get_recipes_limit(self.request)
+            ),
+            to_attr='latest_recipes',
+        ))
 
 
 class FollowViewSet(viewsets.ModelViewSet):
@@ -194,7 +523,12 @@ class FollowViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        return serializer.save(user=self.request.user, author=author)
+        with transaction.atomic():
+            change_counter(
+                User.objects.filter(pk=author.pk), 'followers_count', 1
+            )
+            follow(self.request.user.id, author.id)
+            return serializer.save(user=self.request.user, author=author)
 
     def destroy(self, request, users_id):
         serializer = self.get_serializer(data=request.data)
@@ -206,5 +540,11 @@ class FollowViewSet(viewsets.ModelViewSet):
         instance = Follow.objects.filter(
             author=users_id, user=request.user
         )
-        self.perform_destroy(instance)
+        with transaction.atomic():
+            deleted, _ = instance.delete()
+            change_counter(
+                User.objects.filter(pk=users_id), 'followers_count', -deleted
+            )
+            if deleted:
+                unfollow(request.user.id, users_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,138 @@
+import threading
+
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+
+class ConnectionPool:
+    """Простаивающие соединения одного процесса.
+
+    Хранит не больше size открытых соединений. Если свободных нет,
+    открывается новое соединение, лишние при возврате закрываются.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return None
+
+    def put(self, connection):
+        """Возвращает соединение в пул, если оно в исправном состоянии."""
+        if connection.closed:
+            return
+        status = connection.info.transaction_status
+        if status in (
+            extensions.TRANSACTION_STATUS_INTRANS,
+            extensions.TRANSACTION_STATUS_INERROR,
+        ):
+            try:
+                connection.rollback()
+            except Exception:
+                connection.close()
+                return
+        elif status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.close()
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, size):
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(size)
+        return _pools[alias]
+
+
+def is_alive(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            connection.rollback()
+    except Exception:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с проверкой постоянных соединений и пулом процесса.
+
+    CONN_HEALTH_CHECKS: постоянное соединение (CONN_MAX_AGE > 0)
+    проверяется запросом SELECT 1 перед первым использованием в каждом
+    запросе, как в Django 4.1, упавшее соединение заменяется новым.
+    POOL_SIZE: при закрытии соединение не рвётся, а возвращается в пул
+    процесса такого размера и выдаётся следующему запросу или потоку.
+    """
+    health_check_done = False
+
+    @property
+    def pool(self):
+        size = self.settings_dict.get('POOL_SIZE') or 0
+        if size <= 0:
+            return None
+        return get_pool(self.alias, size)
+
+    @property
+    def health_check_enabled(self):
+        return bool(self.settings_dict.get('CONN_HEALTH_CHECKS'))
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is not None:
+            while True:
+                connection = pool.get()
+                if connection is None:
+                    break
+                if not self.health_check_enabled or is_alive(connection):
+                    return self.configure_pooled(connection)
+                connection.close()
+        return super().get_new_connection(conn_params)
+
+    def configure_pooled(self, connection):
+        """Настройки, которые get_new_connection хранит в обёртке."""
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.put(self.connection)
+        return None
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and self.health_check_enabled
+            and not self.health_check_done
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
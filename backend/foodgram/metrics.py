@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from rest_framework.response import Response
+
+logger = logging.getLogger('foodgram.metrics')
+
+LABELS = ('view', 'method')
+
+REQUEST_SECONDS = Histogram(
+    'foodgram_request_seconds',
+    'Время обработки запроса',
+    LABELS,
+)
+REQUEST_QUERIES = Histogram(
+    'foodgram_request_queries',
+    'Количество SQL-запросов на запрос',
+    LABELS,
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20, 50, 100, 200, 500),
+)
+DB_SECONDS = Histogram(
+    'foodgram_request_db_seconds',
+    'Суммарное время SQL-запросов на запрос',
+    LABELS,
+)
+SERIALIZER_SECONDS = Histogram(
+    'foodgram_request_serializer_seconds',
+    'Время сериализации ответа',
+    LABELS,
+)
+RESPONSE_BYTES = Histogram(
+    'foodgram_response_bytes',
+    'Размер ответа',
+    LABELS,
+    buckets=tuple(4 ** power * 256 for power in range(8)),
+)
+
+
+class RequestStats:
+    """Счётчики одного запроса."""
+    max_logged_queries = 50
+
+    def __init__(self, collect_sql):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.sql = [] if collect_sql else None
+
+    def add_query(self, sql, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+        if self.sql is not None and len(self.sql) < self.max_logged_queries:
+            self.sql.append(f'{seconds * 1000:.1f} ms  {sql}')
+
+
+_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(connection, **kwargs):
+    """Подключает учёт запросов к соединению с БД.
+
+    Обёртка ставится на соединение, а не на время запроса, потому что
+    асинхронные представления ходят в БД из потоков пула.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def serializer_data(serializer):
+    """serializer.data с учётом времени сериализации в метриках запроса.
+
+    Вложенные сериализаторы входят в замер внешнего целиком.
+    """
+    stats = _stats.get()
+    if stats is None:
+        return serializer.data
+    started = time.perf_counter()
+    try:
+        return serializer.data
+    finally:
+        stats.serializer_seconds += time.perf_counter() - started
+
+
+class SerializerMetricsMixin:
+    """list и retrieve DRF с замером времени сериализации ответа."""
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(
+                serializer_data(serializer)
+            )
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer_data(serializer))
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        return Response(serializer_data(serializer))
+
+
+class MetricsMiddleware:
+    """Метрики Prometheus по имени маршрута и методу запроса.
+
+    Счётчики запроса доступны как request.metrics.
+    Запросы дороже METRICS_QUERY_BUDGET SQL-запросов или дольше
+    METRICS_LATENCY_BUDGET мс пишутся в лог foodgram.metrics вместе
+    с выполненным SQL. Нулевой бюджет отключает проверку.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Под ASGI обработчик вызывает middleware как корутину,
+            # без перехода в поток синхронных представлений.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats, token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def start(self, request):
+        query_budget = settings.METRICS_QUERY_BUDGET
+        latency_budget = settings.METRICS_LATENCY_BUDGET
+        stats = RequestStats(collect_sql=bool(query_budget or latency_budget))
+        for connection in connections.all():
+            install_query_recorder(connection)
+        request.metrics = stats
+        return stats, _stats.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        seconds = time.perf_counter() - started
+        query_budget = settings.METRICS_QUERY_BUDGET
+        latency_budget = settings.METRICS_LATENCY_BUDGET
+
+        match = request.resolver_match
+        labels = (match.view_name if match else 'unresolved', request.method)
+        REQUEST_SECONDS.labels(*labels).observe(seconds)
+        REQUEST_QUERIES.labels(*labels).observe(stats.queries)
+        DB_SECONDS.labels(*labels).observe(stats.db_seconds)
+        SERIALIZER_SECONDS.labels(*labels).observe(stats.serializer_seconds)
+        if not response.streaming:
+            RESPONSE_BYTES.labels(*labels).observe(len(response.content))
+
+        if (
+            (query_budget and stats.queries > query_budget)
+            or (latency_budget and seconds * 1000 > latency_budget)
+        ):
+            logger.warning(
+                '%s %s: %.1f ms, %d SQL-запросов (%.1f ms), '
+                'сериализация %.1f ms\n%s',
+                request.method,
+                request.get_full_path(),
+                seconds * 1000,
+                stats.queries,
+                stats.db_seconds * 1000,
+                stats.serializer_seconds * 1000,
+                '\n'.join(stats.sql),
+            )
+        return response
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus.
+
+    При запуске нескольких воркеров gunicorn метрики собираются из
+    каталога PROMETHEUS_MULTIPROC_DIR.
+    """
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(
+        generate_latest(registry),
+        content_type=CONTENT_TYPE_LATEST
+    )
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +73,8 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
+        # foodgram.db.postgresql - тот же бэкенд с пулом соединений и
+        # проверкой постоянных соединений, включается через DB_ENGINE.
         'ENGINE': os.getenv(
             'DB_ENGINE',
             default='django.db.backends.postgresql'
@@ -86,10 +89,63 @@ DATABASES = {
         ),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT')
+        'PORT': os.getenv('DB_PORT'),
+        # Секунд жизни постоянного соединения, 0 - новое на каждый запрос.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        # Для foodgram.db.postgresql: проверка постоянного соединения
+        # перед использованием и размер пула соединений процесса.
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_CONN_HEALTH_CHECKS', default='true'
+        ).lower() == 'true',
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', default=0)),
     }
 }
 
+# Потоков для чтения из БД в асинхронных представлениях (api.async_views)
+# на один ASGI-воркер. У каждого потока своё соединение с БД, 0 - чтение
+# в общем потоке синхронных представлений (так работают тесты).
+
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', default=8))
+
+# Cache
+# Бэкенд выбирается переменной CACHE_BACKEND: locmem, file или redis.
+# locmem - только для одного процесса: версии данных (recipes.cache)
+# должны быть общими для всех воркеров, поэтому gunicorn с несколькими
+# воркерами с ним не запускается.
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django_redis.cache.RedisCache',
+}
+
+CACHE_LOCATIONS = {
+    'locmem': 'foodgram',
+    'file': '/tmp/foodgram_cache',
+    'redis': 'redis://127.0.0.1:6379/1',
+}
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', default='locmem')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default=CACHE_LOCATIONS[CACHE_BACKEND]
+        ),
+    }
+}
+
+if CACHE_BACKEND != 'redis':
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', default=5000)),
+    }
+
+RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_TIMEOUT', default=24 * 60 * 60)
+)
+
 # Authentication settings
 
 AUTH_USER_MODEL = 'users.User'
@@ -136,6 +192,8 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = BASE_DIR / 'media/'
 
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
+
 STATIC_ROOT = BASE_DIR / 'static/'
 
 # Default primary key field type
@@ -144,6 +202,10 @@ STATIC_ROOT = BASE_DIR / 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Неключевые столбцы покрывающих индексов (include) есть только в
+# PostgreSQL, на SQLite для локального запуска индексы создаются без них.
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -158,6 +220,83 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Pagination
+
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', default=60)
+)
+
+# Recipe images
+
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE', default=1280))
+
+RECIPE_IMAGE_WIDTHS = [
+    int(width) for width in os.getenv(
+        'RECIPE_IMAGE_WIDTHS', default='300,600'
+    ).split(',')
+]
+
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', default=85))
+
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', default=2))
+
+IMAGE_PROCESS_TIMEOUT = int(os.getenv('IMAGE_PROCESS_TIMEOUT', default=30))
+
+# Metrics
+# Запросы сверх бюджета (число SQL-запросов, мс) пишутся в лог
+# foodgram.metrics вместе с SQL, 0 отключает проверку.
+
+METRICS_QUERY_BUDGET = int(os.getenv('METRICS_QUERY_BUDGET', default=0))
+
+METRICS_LATENCY_BUDGET = int(os.getenv('METRICS_LATENCY_BUDGET', default=0))
+
+# Trending recipes
+# Оценка - сумма добавлений в избранное и списки покупок с весами,
+# вклад которых убывает вдвое каждые TRENDING_HALF_LIFE_HOURS часов.
+
+TRENDING_WINDOW_DAYS = int(os.getenv('TRENDING_WINDOW_DAYS', default=14))
+
+TRENDING_HALF_LIFE_HOURS = float(
+    os.getenv('TRENDING_HALF_LIFE_HOURS', default=36)
+)
+
+TRENDING_SIZE = int(os.getenv('TRENDING_SIZE', default=200))
+
+# Home feed
+# Новые рецепты раскладываются в ленты подписчиков при публикации,
+# рецепты авторов с числом подписчиков больше FEED_FANOUT_LIMIT
+# добавляются в ленту при чтении.
+
+FEED_STORES = {
+    'db': 'recipes.feed.DatabaseFeedStore',
+    'redis': 'recipes.feed.RedisFeedStore',
+}
+
+FEED_STORE = FEED_STORES[os.getenv('FEED_STORE', default='db')]
+
+FEED_REDIS_URL = os.getenv(
+    'FEED_REDIS_URL', default='redis://127.0.0.1:6379/2'
+)
+
+FEED_SIZE = int(os.getenv('FEED_SIZE', default=500))
+
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=1000))
+
+# Recommendations
+
+RECOMMENDATIONS_SIZE = int(os.getenv('RECOMMENDATIONS_SIZE', default=20))
+
+# Shopping list export
+
+SHOPPING_LIST_STREAM_CHUNK = int(
+    os.getenv('SHOPPING_LIST_STREAM_CHUNK', default=64 * 1024)
+)
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'SERIALIZERS': {
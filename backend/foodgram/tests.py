@@ -0,0 +1,144 @@
+import asyncio
+import itertools
+import time
+from unittest import skipUnless
+
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from rest_framework import serializers
+
+from .db.postgresql import base
+from .metrics import MetricsMiddleware, serializer_data
+
+aliases = itertools.count()
+
+
+@skipUnless(
+    isinstance(connection, base.DatabaseWrapper),
+    'нужен бэкенд foodgram.db.postgresql'
+)
+class PooledConnectionTests(SimpleTestCase):
+    """Пул и проверка соединений на настоящем PostgreSQL."""
+    databases = {'default'}
+
+    def setUp(self):
+        self.alias = f'pool-test-{next(aliases)}'
+        # Выполняется последним, после закрытия обёрток.
+        self.addCleanup(self.close_pool)
+
+    def close_pool(self):
+        pool = base._pools.pop(self.alias, None)
+        for raw in pool.idle if pool else ():
+            raw.close()
+
+    def make_wrapper(self, **settings):
+        wrapper = base.DatabaseWrapper(
+            {
+                **connection.settings_dict,
+                'POOL_SIZE': 1,
+                'CONN_HEALTH_CHECKS': True,
+                **settings,
+            },
+            alias=self.alias,
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def backend_pid(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def terminate(self, pid):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+
+    def test_closed_connection_is_reused(self):
+        first = self.make_wrapper()
+        pid = self.backend_pid(first)
+        first.close()
+        self.assertEqual(len(base._pools[self.alias].idle), 1)
+        second = self.make_wrapper()
+        self.assertEqual(self.backend_pid(second), pid)
+
+    def test_open_transaction_is_rolled_back(self):
+        first = self.make_wrapper()
+        first.set_autocommit(False)
+        with first.cursor() as cursor:
+            cursor.execute('CREATE TEMPORARY TABLE pool_test (id int)')
+        first.close()
+        second = self.make_wrapper()
+        with second.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_class WHERE relname = 'pool_test' "
+                'AND pg_table_is_visible(oid)'
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_dead_pooled_connection_is_replaced(self):
+        first = self.make_wrapper()
+        pid = self.backend_pid(first)
+        first.close()
+        self.terminate(pid)
+        second = self.make_wrapper()
+        self.assertNotEqual(self.backend_pid(second), pid)
+        self.assertEqual(base._pools[self.alias].idle, [])
+
+    def test_dead_persistent_connection_is_replaced(self):
+        wrapper = self.make_wrapper(POOL_SIZE=0, CONN_MAX_AGE=60)
+        pid = self.backend_pid(wrapper)
+        self.terminate(pid)
+        # Начало следующего HTTP-запроса.
+        wrapper.close_if_unusable_or_obsolete()
+        self.assertNotEqual(self.backend_pid(wrapper), pid)
+
+
+class SlowSerializer(serializers.Serializer):
+    value = serializers.SerializerMethodField()
+
+    def get_value(self, obj):
+        time.sleep(0.01)
+        return obj
+
+
+class MetricsMiddlewareTests(SimpleTestCase):
+    """Middleware работает в обоих режимах и не блокирует цикл событий."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_sync(self):
+        def view(request):
+            serializer_data(SlowSerializer(1))
+            return HttpResponse('ok')
+
+        middleware = MetricsMiddleware(view)
+        request = self.factory.get('/')
+        self.assertFalse(asyncio.iscoroutinefunction(middleware))
+        self.assertEqual(middleware(request).content, b'ok')
+        self.assertGreaterEqual(request.metrics.serializer_seconds, 0.01)
+
+    def test_async(self):
+        async def view(request):
+            await asyncio.sleep(0.2)
+            return HttpResponse('ok')
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+        async def requests():
+            return await asyncio.gather(*(
+                middleware(self.factory.get('/')) for _ in range(5)
+            ))
+
+        started = time.perf_counter()
+        responses = async_to_sync(requests)()
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(
+            [response.content for response in responses], [b'ok'] * 5
+        )
+
+    def test_serializer_data_without_request(self):
+        self.assertEqual(serializer_data(SlowSerializer(1)), {'value': 1})
@@ -0,0 +1,30 @@
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(
+    os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+
+def on_starting(server):
+    # Версии данных recipes.cache в locmem видит только записавший их
+    # воркер, остальные отдавали бы устаревшие ответы из своих кэшей.
+    cache_backend = os.getenv('CACHE_BACKEND', 'locmem')
+    if server.cfg.workers > 1 and cache_backend == 'locmem':
+        raise RuntimeError(
+            'CACHE_BACKEND=locmem несовместим с несколькими воркерами, '
+            'задайте CACHE_BACKEND=redis или GUNICORN_WORKERS=1'
+        )
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -5,9 +5,12 @@ from .models import (
     Ingredient,
     Recipe,
     IngredientAmount,
+    MediaFile,
     ShoppingCart,
+    ShoppingCartTotal,
     Tag
 )
+from .search import update_search_vectors
 
 
 class IngredientAmountInline(admin.TabularInline):
@@ -29,15 +32,19 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'count_favorites')
+    list_display = (
+        'name', 'author', 'favorites_count', 'shopping_cart_count'
+    )
     list_filter = ('name', 'author__email', 'tags')
+    list_select_related = ('author',)
+    readonly_fields = ('favorites_count', 'shopping_cart_count')
     inlines = [
         IngredientAmountInline
     ]
 
-    @admin.display(description='В избранном')
-    def count_favorites(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_vectors(Recipe.objects.filter(pk=form.instance.pk))
 
 
 @admin.register(Favorite)
@@ -50,6 +57,34 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(ShoppingCartTotal)
+class ShoppingCartTotalAdmin(admin.ModelAdmin):
+    """Итоги только для просмотра.
+
+    Их ведут представления API, расхождения исправляет команда
+    rebuild_shopping_cart_totals.
+    """
+    list_display = ('user', 'ingredient', 'amount')
+    list_select_related = ('user', 'ingredient')
+    readonly_fields = ('user', 'ingredient', 'amount')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MediaFile)
+class MediaFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'references', 'touched')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'references', 'touched')
+
+
 @admin.register(IngredientAmount)
 class RecipeIngredientCartAdmin(admin.ModelAdmin):
     pass
@@ -0,0 +1,45 @@
+import datetime
+import time
+
+from django.core.cache import cache
+
+INGREDIENTS = 'ingredients'
+TAGS = 'tags'
+RECIPE_INGREDIENTS = 'recipe_ingredients'
+
+
+def version_key(name):
+    return f'version:{name}'
+
+
+def get_version(name):
+    """Текущая версия набора данных name.
+
+    Начальное значение берётся из времени, чтобы после вытеснения ключа
+    из кэша версия не совпала с одной из прежних.
+    """
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Увеличивает версию, делая устаревшими все данные прежней версии.
+
+    Новая версия - текущее время в наносекундах (но больше прежней),
+    поэтому по версии видно и время изменения данных.
+    """
+    key = version_key(name)
+    version = max(time.time_ns(), (cache.get(key) or 0) + 1)
+    cache.set(key, version, timeout=None)
+    return version
+
+
+def version_time(version):
+    """Время изменения данных, соответствующее версии."""
+    return datetime.datetime.fromtimestamp(
+        version / 10 ** 9, datetime.timezone.utc
+    )
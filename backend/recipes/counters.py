@@ -0,0 +1,111 @@
+import itertools
+
+from django.apps import apps
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Денормализованные счётчики: (модель, поле, считаемая модель, ссылка).
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.Favorite', 'recipe'),
+    (
+        'recipes.Recipe', 'shopping_cart_count',
+        'recipes.ShoppingCart', 'recipe'
+    ),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+class CountersModelMixin:
+    """Модель, save() которой не записывает счётчики из COUNTERS.
+
+    Счётчики меняет только change_counter атомарным UPDATE, а экземпляр,
+    прочитанный раньше, иначе вернул бы в таблицу прежние значения.
+    """
+
+    def save(
+        self, force_insert=False, force_update=False, using=None,
+        update_fields=None
+    ):
+        if (
+            update_fields is None
+            and not force_insert
+            and not self._state.adding
+        ):
+            excluded = self.get_deferred_fields() | {
+                field for model, field, _, _ in COUNTERS
+                if model == self._meta.label
+            }
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in excluded
+                and field.name not in excluded
+            ]
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=update_fields,
+        )
+
+
+def change_counter(queryset, field, delta):
+    """Атомарно меняет счётчик field у объектов queryset на delta."""
+    if delta:
+        queryset.update(**{field: F(field) + delta})
+
+
+def actual_count(related, link):
+    return Coalesce(
+        Subquery(
+            related.objects.filter(
+                **{link: OuterRef('pk')}
+            ).order_by().values(link).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+def counters(get_model=apps.get_model):
+    for model, field, related, link in COUNTERS:
+        yield (
+            get_model(model), field, actual_count(get_model(related), link)
+        )
+
+
+def fill_counters(get_model=apps.get_model):
+    """Пересчитывает все счётчики одним UPDATE на счётчик."""
+    for model, field, actual in counters(get_model):
+        model.objects.update(**{field: actual})
+
+
+def drifted(model, field, actual):
+    """id объектов, у которых счётчик расходится с пересчётом."""
+    return model.objects.annotate(actual=actual).exclude(
+        **{field: F('actual')}
+    ).order_by().values_list('pk', flat=True)
+
+
+def reconcile_counters(batch_size=1000, check=False):
+    """Исправляет расхождения счётчиков, возвращает их число по полям.
+
+    Исправление выполняется тем же коррелированным подзапросом в
+    UPDATE, а не записью прочитанных значений, поэтому не затирает
+    параллельные инкременты.
+    """
+    result = {}
+    for model, field, actual in counters():
+        ids = list(drifted(model, field, actual))
+        result[f'{model._meta.label}.{field}'] = len(ids)
+        if check:
+            continue
+        ids = iter(ids)
+        while True:
+            batch = list(itertools.islice(ids, batch_size))
+            if not batch:
+                break
+            model.objects.filter(pk__in=batch).update(**{field: actual})
+    return result
@@ -0,0 +1,240 @@
+import datetime
+import functools
+import itertools
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.utils.module_loading import import_string
+from users.models import Follow
+
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+def is_before(position, created, recipe_id):
+    """Идёт ли запись (created, recipe_id) в ленте после position."""
+    return position is None or (created, recipe_id) < tuple(position)
+
+
+class DatabaseFeedStore:
+    """Ленты в таблице FeedEntry, страница - один индексный запрос."""
+
+    def push(self, user_ids, entries):
+        """Добавляет записи (created, recipe_id) в ленты пользователей."""
+        FeedEntry.objects.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id, recipe_id=recipe_id, created=created
+                )
+                for user_id in user_ids
+                for created, recipe_id in entries
+            ),
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        FeedEntry.objects.filter(
+            user_id__in=user_ids,
+            created__lt=Subquery(
+                FeedEntry.objects.filter(
+                    user=OuterRef('user')
+                ).order_by('-created', '-recipe_id').values('created')[
+                    settings.FEED_SIZE - 1:settings.FEED_SIZE
+                ]
+            ),
+        ).delete()
+
+    def remove(self, user_id, recipe_ids):
+        FeedEntry.objects.filter(
+            user_id=user_id, recipe_id__in=recipe_ids
+        ).delete()
+
+    def page(self, user_id, position, limit):
+        entries = FeedEntry.objects.filter(user_id=user_id)
+        if position is not None:
+            created, recipe_id = position
+            entries = entries.filter(
+                Q(created__lt=created)
+                | Q(created=created, recipe_id__lt=recipe_id)
+            )
+        return list(entries.order_by('-created', '-recipe_id').values_list(
+            'created', 'recipe_id'
+        )[:limit])
+
+
+class RedisFeedStore:
+    """Ленты в сортированных множествах Redis-совместимого сервера.
+
+    Оценка - время публикации в микросекундах, элемент - id рецепта
+    с нулями слева, чтобы при равных оценках порядок совпадал с числовым.
+    Удалённые рецепты из лент не вычищаются, их отбрасывает чтение.
+    """
+    id_width = 12
+
+    def __init__(self):
+        import redis
+        self.redis = redis.Redis.from_url(settings.FEED_REDIS_URL)
+
+    def key(self, user_id):
+        return f'feed:{user_id}'
+
+    def score(self, created):
+        return int(created.timestamp()) * 10 ** 6 + created.microsecond
+
+    def member(self, recipe_id):
+        return str(recipe_id).zfill(self.id_width)
+
+    def push(self, user_ids, entries):
+        mapping = {
+            self.member(recipe_id): self.score(created)
+            for created, recipe_id in entries
+        }
+        pipeline = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.zadd(self.key(user_id), mapping)
+            pipeline.zremrangebyrank(
+                self.key(user_id), 0, -settings.FEED_SIZE - 1
+            )
+        pipeline.execute()
+
+    def remove(self, user_id, recipe_ids):
+        recipe_ids = iter(recipe_ids)
+        while True:
+            batch = list(itertools.islice(recipe_ids, BATCH_SIZE))
+            if not batch:
+                return
+            self.redis.zrem(
+                self.key(user_id), *(self.member(pk) for pk in batch)
+            )
+
+    def page(self, user_id, position, limit):
+        key = self.key(user_id)
+        high, skip = '+inf', 0
+        if position is not None:
+            high = self.score(position[0])
+            skip = self.redis.zcount(key, high, high)
+        rows = self.redis.zrevrangebyscore(
+            key, high, '-inf', start=0, num=limit + skip, withscores=True
+        )
+        entries = []
+        for member, score in rows:
+            score = int(score)
+            created = datetime.datetime.fromtimestamp(
+                score // 10 ** 6, datetime.timezone.utc
+            ).replace(microsecond=score % 10 ** 6)
+            recipe_id = int(member)
+            if is_before(position, created, recipe_id):
+                entries.append((created, recipe_id))
+        return entries[:limit]
+
+
+@functools.lru_cache(maxsize=None)
+def get_store():
+    return import_string(settings.FEED_STORE)()
+
+
+def fans_out(author_id):
+    """Раскладываются ли рецепты автора по лентам подписчиков.
+
+    Рецепты авторов с числом подписчиков больше FEED_FANOUT_LIMIT
+    читаются при запросе ленты.
+    """
+    followers = User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True
+    ).first()
+    return (
+        followers is not None
+        and followers <= settings.FEED_FANOUT_LIMIT
+    )
+
+
+def follower_batches(author_id):
+    """id подписчиков автора пачками по BATCH_SIZE."""
+    followers = Follow.objects.filter(author_id=author_id).order_by(
+        'user_id'
+    ).values_list('user_id', flat=True)
+    last = 0
+    while True:
+        batch = list(followers.filter(user_id__gt=last)[:BATCH_SIZE])
+        if batch:
+            yield batch
+        if len(batch) < BATCH_SIZE:
+            return
+        last = batch[-1]
+
+
+def publish(recipe):
+    """Раскладывает рецепт в ленты подписчиков автора после коммита."""
+    def fan_out():
+        if not fans_out(recipe.author_id):
+            return
+        store = get_store()
+        for followers in follower_batches(recipe.author_id):
+            store.push(followers, [(recipe.created, recipe.id)])
+    transaction.on_commit(fan_out)
+
+
+def follow(user_id, author_id):
+    """Добавляет в ленту подписчика последние рецепты автора."""
+    def backfill():
+        if not fans_out(author_id):
+            return
+        get_store().push([user_id], list(
+            Recipe.objects.filter(author_id=author_id).order_by(
+                '-created', '-id'
+            ).values_list('created', 'id')[:settings.FEED_SIZE]
+        ))
+    transaction.on_commit(backfill)
+
+
+def rebuild_feed(user_id):
+    """Раскладывает в ленту пользователя рецепты всех его подписок.
+
+    Для лент, созданных до раскладки при публикации и подписке.
+    Записи, которые уже есть в ленте, не дублируются.
+    """
+    authors = User.objects.filter(
+        author__user_id=user_id,
+        followers_count__lte=settings.FEED_FANOUT_LIMIT,
+    ).values('id')
+    entries = list(Recipe.objects.filter(author__in=authors).order_by(
+        '-created', '-id'
+    ).values_list('created', 'id')[:settings.FEED_SIZE])
+    if entries:
+        get_store().push([user_id], entries)
+
+
+def unfollow(user_id, author_id):
+    def clean():
+        get_store().remove(user_id, Recipe.objects.filter(
+            author_id=author_id
+        ).values_list('id', flat=True).iterator())
+    transaction.on_commit(clean)
+
+
+def read_feed(user_id, position, limit):
+    """Страница ленты: до limit + 1 рецептов строго после position.
+
+    Записи хранилища сливаются с рецептами популярных авторов, на
+    которых подписан пользователь: их рецепты не раскладываются.
+    Возвращает список пар (created, recipe_id) по убыванию.
+    """
+    entries = get_store().page(user_id, position, limit + 1)
+    popular = User.objects.filter(
+        author__user_id=user_id,
+        followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values('id')
+    recipes = Recipe.objects.filter(author__in=popular)
+    if position is not None:
+        created, recipe_id = position
+        recipes = recipes.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=recipe_id)
+        )
+    entries.extend(recipes.order_by('-created', '-id').values_list(
+        'created', 'id'
+    )[:limit + 1])
+    return sorted(set(entries), reverse=True)[:limit + 1]
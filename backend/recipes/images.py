@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+# Форматы, принимаемые при загрузке.
+UPLOAD_FORMATS = ('JPEG', 'PNG', 'GIF')
+
+
+def encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    options = {'optimize': True}
+    if image_format in ('JPEG', 'WEBP'):
+        options['quality'] = quality
+    if image_format == 'JPEG':
+        options['progressive'] = True
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_variants(data, max_size, widths, quality):
+    """Готовит все варианты изображения за одно декодирование.
+
+    Выполняется в отдельном процессе. Возвращает формат основного
+    изображения и список (ширина, формат, байты), первым идёт основное
+    изображение, уменьшенное до max_size по большей стороне.
+    Неподдерживаемые или повреждённые данные дают OSError.
+    """
+    with Image.open(io.BytesIO(data), formats=UPLOAD_FORMATS) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode in ('RGBA', 'LA', 'P') and (
+            image.mode != 'P' or 'transparency' in image.info
+        ):
+            image_format = 'PNG'
+            image = image.convert('RGBA')
+        else:
+            image_format = 'JPEG'
+            image = image.convert('RGB')
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    variants = [
+        (image.width, image_format, encode(image, image_format, quality)),
+        (image.width, 'WEBP', encode(image, 'WEBP', quality)),
+    ]
+    for width in sorted(widths):
+        if width >= image.width:
+            continue
+        height = max(round(image.height * width / image.width), 1)
+        thumbnail = image.resize((width, height), Image.LANCZOS)
+        for variant_format in (image_format, 'WEBP'):
+            variants.append((
+                width,
+                variant_format,
+                encode(thumbnail, variant_format, quality)
+            ))
+    return image_format, variants
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor():
+    return ProcessPoolExecutor(
+        max_workers=settings.IMAGE_PROCESS_WORKERS,
+        mp_context=multiprocessing.get_context('spawn'),
+    )
+
+
+def reset_executor(executor):
+    """Заменяет пул, в котором погиб процесс: сломанный пул не оживает."""
+    if get_executor() is executor:
+        get_executor.cache_clear()
+    executor.shutdown(wait=False)
+
+
+class ProcessedImage(ContentFile):
+    """Основное изображение рецепта вместе с его вариантами.
+
+    Имена файлов строятся из SHA-256 основного изображения, поэтому
+    одинаковые загрузки дают одинаковые имена.
+    """
+
+    def __init__(self, image_format, variants):
+        _, _, content = variants[0]
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.variants = variants
+        super().__init__(
+            content,
+            name=f'{self.digest}.{EXTENSIONS[image_format]}'
+        )
+
+    def save_variants(self, name):
+        """Сохраняет варианты рядом с основным файлом name.
+
+        Возвращает {ширина: {расширение: имя файла}}.
+        """
+        upload_to = os.path.dirname(name)
+        saved = {}
+        for index, (width, image_format, content) in enumerate(
+            self.variants
+        ):
+            extension = EXTENSIONS[image_format]
+            if index == 0:
+                variant_name = name
+            else:
+                suffix = '' if index == 1 else f'_{width}'
+                variant_name = default_storage.save(
+                    os.path.join(
+                        upload_to, f'{self.digest}{suffix}.{extension}'
+                    ),
+                    ContentFile(content)
+                )
+            saved.setdefault(str(width), {})[extension] = variant_name
+        return saved
+
+
+def process_image(data):
+    """Обрабатывает загруженное изображение вне потока запроса.
+
+    При IMAGE_PROCESS_WORKERS = 0 обработка идёт в текущем процессе.
+    Если процесс пула погиб (например, убит по нехватке памяти), пул
+    пересоздаётся и обработка повторяется один раз, затем
+    BrokenProcessPool передаётся вызывающему.
+    """
+    arguments = (
+        data,
+        settings.RECIPE_IMAGE_MAX_SIZE,
+        settings.RECIPE_IMAGE_WIDTHS,
+        settings.RECIPE_IMAGE_QUALITY,
+    )
+    if not settings.IMAGE_PROCESS_WORKERS:
+        return ProcessedImage(*render_variants(*arguments))
+    for attempt in range(2):
+        executor = get_executor()
+        try:
+            future = executor.submit(render_variants, *arguments)
+            result = future.result(timeout=settings.IMAGE_PROCESS_TIMEOUT)
+        except BrokenProcessPool:
+            reset_executor(executor)
+            if attempt:
+                raise
+        else:
+            return ProcessedImage(*result)
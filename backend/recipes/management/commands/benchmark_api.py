@@ -0,0 +1,295 @@
+import base64
+import io
+import json
+import statistics
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import override_settings
+from PIL import Image
+from recipes.models import Ingredient, IngredientAmount, Recipe, Tag
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+User = get_user_model()
+
+BULK_SIZE = 20
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def image_data():
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), (90, 160, 60)).save(buffer, 'JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+class Command(BaseCommand):
+    help = 'Замер задержки и числа SQL-запросов всех эндпоинтов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--output',
+            help='Сохранить результаты в JSON-файл',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON-файл прошлого запуска для сравнения',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Допустимый относительный рост p95',
+        )
+        parser.add_argument(
+            '--min-delta',
+            type=float,
+            default=1.0,
+            help='Рост p95 меньше этого числа мс не считается регрессией',
+        )
+
+    def get_context(self):
+        user = User.objects.annotate(
+            follows=Count('follower', distinct=True),
+            carts=Count('shopping_cart_owner', distinct=True),
+        ).order_by('-follows', '-carts', 'id').first()
+        # Первый - для действий с одним рецептом, остальные - для
+        # массовых.
+        recipes = list(Recipe.objects.exclude(
+            favorite_recipe__user=user
+        ).exclude(recipe_in_shopping_cart__user=user).order_by(
+            'id'
+        ).values_list('id', flat=True)[:BULK_SIZE + 1])
+        recipe = recipes[0] if len(recipes) > 1 else None
+        author = User.objects.exclude(id=user.id).exclude(
+            author__user=user
+        ).order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        tags = list(Tag.objects.order_by('id')[:2])
+        if None in (recipe, author, ingredient) or not tags:
+            raise CommandError(
+                'Недостаточно данных, запустите generate_data'
+            )
+        return {
+            'token': Token.objects.get_or_create(user=user)[0].key,
+            'recipe': recipe,
+            'recipes': recipes[1:],
+            'pantry': list(IngredientAmount.objects.filter(
+                recipe=recipe
+            ).values_list('ingredient_id', flat=True)),
+            'author': author.id,
+            'ingredient': ingredient,
+            'tags': tags,
+            'image': image_data(),
+        }
+
+    def get_steps(self, context):
+        """Шаги одной итерации: (имя, метод, путь, данные, аноним).
+
+        Изменяющие шаги идут парами, отменяющими друг друга, поэтому
+        повторные итерации работают с одними и теми же данными.
+        """
+        recipe = f'/api/recipes/{context["recipe"]}/'
+        author = context['author']
+        tags = context['tags']
+        bulk = {'recipes': context['recipes']}
+        recipe_body = {
+            'tags': [tag.id for tag in tags],
+            'ingredients': [{'id': context['ingredient'].id, 'amount': 10}],
+            'name': 'Рецепт для замера',
+            'image': context['image'],
+            'text': 'Текст',
+            'cooking_time': 10,
+        }
+        return [
+            ('users-list', 'get', '/api/users/', None, False),
+            ('users-detail', 'get', f'/api/users/{author}/', None, False),
+            ('users-me', 'get', '/api/users/me/', None, False),
+            ('tags-list', 'get', '/api/tags/', None, False),
+            ('tags-detail', 'get', f'/api/tags/{tags[0].id}/', None, False),
+            (
+                'ingredients-search', 'get',
+                '/api/ingredients/?name='
+                + context['ingredient'].name[:3],
+                None, False
+            ),
+            (
+                'ingredients-detail', 'get',
+                f'/api/ingredients/{context["ingredient"].id}/',
+                None, False
+            ),
+            ('recipes-list', 'get', '/api/recipes/', None, False),
+            ('recipes-list-anonymous', 'get', '/api/recipes/', None, True),
+            (
+                'recipes-list-filtered', 'get',
+                f'/api/recipes/?tags={tags[0].slug}&is_favorited=1',
+                None, False
+            ),
+            (
+                'recipes-list-author', 'get',
+                f'/api/recipes/?author={author}', None, False
+            ),
+            ('recipes-list-cursor', 'get', '/api/recipes/?cursor=', None,
+             False),
+            ('recipes-detail', 'get', recipe, None, False),
+            (
+                'recipes-recommendations', 'get', recipe + 'recommendations/',
+                None, False
+            ),
+            ('recipes-trending', 'get', '/api/recipes/trending/', None,
+             True),
+            (
+                'recipes-trending-week', 'get',
+                '/api/recipes/trending/?period=week', None, True
+            ),
+            ('recipes-feed', 'get', '/api/recipes/feed/', None, False),
+            (
+                'recipes-match', 'get',
+                '/api/recipes/match/?ingredients='
+                + ','.join(map(str, context['pantry'])),
+                None, False
+            ),
+            (
+                'recipes-download-shopping-cart', 'get',
+                '/api/recipes/download_shopping_cart/', None, False
+            ),
+            (
+                'users-subscriptions', 'get',
+                '/api/users/subscriptions/?recipes_limit=3', None, False
+            ),
+            ('recipes-favorite-add', 'post', recipe + 'favorite/', None,
+             False),
+            ('recipes-favorite-remove', 'delete', recipe + 'favorite/',
+             None, False),
+            ('recipes-shopping-cart-add', 'post', recipe + 'shopping_cart/',
+             None, False),
+            ('recipes-shopping-cart-remove', 'delete',
+             recipe + 'shopping_cart/', None, False),
+            ('recipes-favorite-bulk-add', 'post', '/api/recipes/favorite/',
+             bulk, False),
+            ('recipes-favorite-bulk-remove', 'delete',
+             '/api/recipes/favorite/', bulk, False),
+            ('recipes-shopping-cart-bulk-add', 'post',
+             '/api/recipes/shopping_cart/', bulk, False),
+            ('recipes-shopping-cart-bulk-remove', 'delete',
+             '/api/recipes/shopping_cart/', bulk, False),
+            ('users-subscribe', 'post', f'/api/users/{author}/subscribe/',
+             None, False),
+            ('users-unsubscribe', 'delete',
+             f'/api/users/{author}/subscribe/', None, False),
+            ('recipes-create', 'post', '/api/recipes/', recipe_body, False),
+            ('recipes-update', 'patch', '{created}', {'name': 'Новое'},
+             False),
+            ('recipes-delete', 'delete', '{created}', None, False),
+        ]
+
+    def run_step(self, clients, step, state):
+        name, method, path, data, anonymous = step
+        path = path.format(**state)
+        client = clients[anonymous]
+        started = time.perf_counter()
+        if method == 'get':
+            response = client.get(path)
+        else:
+            response = getattr(client, method)(path, data, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{name}: {method.upper()} {path} вернул '
+                f'{response.status_code}'
+            )
+        if name == 'recipes-create':
+            state['created'] = f'/api/recipes/{response.data["id"]}/'
+        metrics = getattr(response.wsgi_request, 'metrics', None)
+        return elapsed, metrics.queries if metrics else None
+
+    def measure(self, options):
+        context = self.get_context()
+        clients = {False: APIClient(), True: APIClient()}
+        clients[False].credentials(
+            HTTP_AUTHORIZATION=f'Token {context["token"]}'
+        )
+        steps = self.get_steps(context)
+        timings = {step[0]: [] for step in steps}
+        queries = {step[0]: 0 for step in steps}
+        for iteration in range(options['warmup'] + options['repeat']):
+            state = {}
+            for step in steps:
+                elapsed, count = self.run_step(clients, step, state)
+                if iteration < options['warmup']:
+                    continue
+                timings[step[0]].append(elapsed)
+                if count is not None:
+                    queries[step[0]] = max(queries[step[0]], count)
+        return {
+            name: {
+                'p50': round(percentile(values, 0.5), 3),
+                'p95': round(percentile(values, 0.95), 3),
+                'p99': round(percentile(values, 0.99), 3),
+                'mean': round(statistics.mean(values), 3),
+                'queries': queries[name],
+            }
+            for name, values in timings.items()
+        }
+
+    def compare(self, results, baseline, options):
+        regressions = []
+        for name, result in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            slower = (
+                result['p95'] > base['p95'] * (1 + options['tolerance'])
+                and result['p95'] - base['p95'] > options['min_delta']
+            )
+            if slower or result['queries'] > base['queries']:
+                regressions.append(
+                    f'{name}: p95 {base["p95"]} -> {result["p95"]} мс, '
+                    f'запросов {base["queries"]} -> {result["queries"]}'
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        # Картинки создаваемых рецептов пишутся во временный каталог.
+        with tempfile.TemporaryDirectory(prefix='foodgram-media-') as media:
+            with override_settings(MEDIA_ROOT=media):
+                results = self.measure(options)
+        baseline = {}
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+        self.stdout.write(
+            f'{"эндпоинт":<36}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"SQL":>6}{"p95 было":>11}'
+        )
+        for name, result in results.items():
+            base = baseline.get(name, {})
+            self.stdout.write(
+                f'{name:<36}{result["p50"]:>9.2f}{result["p95"]:>9.2f}'
+                f'{result["p99"]:>9.2f}{result["queries"]:>6}'
+                f'{base.get("p95", ""):>11}'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'repeat': options['repeat'], 'results': results},
+                    file, ensure_ascii=False, indent=2
+                )
+        regressions = self.compare(results, baseline, options)
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions)
+            )
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import time
+
+from api.async_views import run_view
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory
+from django.urls import resolve
+
+
+class SlowQueries:
+    """Добавляет задержку к каждому SQL-запросу, имитируя медленную БД."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.delay)
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение пропускной способности чтения под ASGI: обёртка '
+        'async_read_view против синхронного представления с медленной БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/recipes/')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument(
+            '--delay',
+            type=float,
+            default=0.1,
+            help='Задержка каждого SQL-запроса, с',
+        )
+        parser.add_argument('--rounds', type=int, default=3)
+
+    def get_handlers(self, path):
+        """Обработчики запроса так, как их вызывает ASGIHandler Django."""
+        view = resolve(path).func
+        plain = getattr(view, '__wrapped__', None)
+        if plain is None:
+            raise CommandError(f'{path} не обёрнут в async_read_view')
+        return {
+            'async_read_view': view,
+            'sync view': sync_to_async(
+                functools.partial(run_view, plain), thread_sensitive=True
+            ),
+        }
+
+    async def run_round(self, handler, path, concurrency):
+        factory = AsyncRequestFactory()
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(
+            handler(factory.get(path)) for _ in range(concurrency)
+        ))
+        finished = time.perf_counter()
+        statuses = {response.status_code for response in responses}
+        if statuses != {200}:
+            raise CommandError(f'{path}: ответы {sorted(statuses)}')
+        return finished - started
+
+    def handle(self, *args, **options):
+        path = options['path']
+        concurrency = options['concurrency']
+        slow_queries = SlowQueries(options['delay'])
+        for connection in connections.all():
+            slow_queries.install(connection)
+        # Потоки пула async_read_view открывают свои соединения.
+        connection_created.connect(slow_queries.install)
+        try:
+            for name, handler in self.get_handlers(path).items():
+                best = min(
+                    async_to_sync(self.run_round)(handler, path, concurrency)
+                    for _ in range(options['rounds'])
+                )
+                self.stdout.write(
+                    f'{name}: {concurrency} запросов за {best:.2f} с, '
+                    f'{concurrency / best:.1f} запросов/с'
+                )
+        finally:
+            connection_created.disconnect(slow_queries.install)
@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client
+
+MODES = {
+    'new': {'CONN_MAX_AGE': 0, 'POOL_SIZE': 0},
+    'persistent': {'CONN_MAX_AGE': 600, 'POOL_SIZE': 0},
+    'pool': {'CONN_MAX_AGE': 0, 'POOL_SIZE': 4},
+}
+
+
+class Command(BaseCommand):
+    help = 'Замер задержки запросов к API при разных режимах соединений с БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='/api/tags/')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument(
+            '--modes',
+            nargs='+',
+            choices=MODES,
+            default=list(MODES),
+        )
+
+    def measure(self, client, url, count):
+        timings = []
+        for _ in range(count):
+            started = time.perf_counter()
+            # Тестовый клиент не закрывает соединения сам, поэтому
+            # сигналы начала и конца запроса эмулируются вручную.
+            close_old_connections()
+            response = client.get(url)
+            close_old_connections()
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(
+                    f'{url} вернул {response.status_code}'
+                )
+        return timings
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        saved = {key: connection.settings_dict.get(key) for key in (
+            'CONN_MAX_AGE', 'POOL_SIZE'
+        )}
+        client = Client()
+        try:
+            for mode in options['modes']:
+                connection.close()
+                connection.settings_dict.update(MODES[mode])
+                self.measure(client, options['url'], options['warmup'])
+                timings = sorted(self.measure(
+                    client, options['url'], options['requests']
+                ))
+                self.stdout.write(
+                    f'{mode:<11} '
+                    f'median {statistics.median(timings):7.2f} ms  '
+                    f'p95 {timings[int(len(timings) * 0.95) - 1]:7.2f} ms  '
+                    f'mean {statistics.mean(timings):7.2f} ms'
+                )
+        finally:
+            connection.close()
+            connection.settings_dict.update(saved)
@@ -0,0 +1,61 @@
+import resource
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management import BaseCommand
+from recipes.recommendations import item_matrix, top_neighbors
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер времени и памяти сборки рекомендаций на синтетической '
+        'матрице без обращения к БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--favorites', type=int, default=1_000_000)
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--recipes', type=int, default=50_000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=settings.RECOMMENDATIONS_SIZE,
+        )
+
+    def zipf_choice(self, rng, size, alpha, count):
+        """count номеров от 0 до size - 1 с весами Zipf 1 / rank ** alpha."""
+        weights = 1 / np.arange(1, size + 1) ** alpha
+        weights /= weights.sum()
+        return rng.permutation(size)[rng.choice(size, count, p=weights)]
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        count = options['favorites']
+        users = self.zipf_choice(rng, options['users'], 0.8, count)
+        items = self.zipf_choice(rng, options['recipes'], 1.0, count)
+        shape = (options['users'], options['recipes'])
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        matrix = item_matrix(users, items, np.ones(count), shape)
+        matrix_seconds = time.perf_counter() - started
+        columns = np.flatnonzero(np.diff(matrix.indptr))
+        neighbors = sum(
+            len(found)
+            for _, found, _ in top_neighbors(matrix, columns, options['size'])
+        )
+        seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f'избранного: {count}, пар после слияния: {matrix.nnz}, '
+            f'рецептов с соседями: {len(columns)}, соседей: {neighbors}\n'
+            f'матрица: {matrix_seconds:.1f} с, всего: {seconds:.1f} с\n'
+            f'пик памяти numpy/scipy: {peak / 2 ** 20:.0f} МБ, '
+            f'максимальный RSS процесса: '
+            f'{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} МБ'
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from recipes.recommendations import build_recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Сборка рекомендаций похожих рецептов по совместным добавлениям '
+        'в избранное и списки покупок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать все рецепты, а не только затронутые',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=settings.RECOMMENDATIONS_SIZE,
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = build_recommendations(options['size'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рекомендации обновлены для {count} рецептов '
+            f'за {time.perf_counter() - started:.1f} с'
+        ))
@@ -0,0 +1,139 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from recipes.models import MediaFile, Recipe, recipe_media_names
+from recipes.storage import TEMPORARY_PREFIX
+
+
+def scan_files(path):
+    """Обходит каталог рекурсивно, не собирая список файлов в памяти."""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+class Command(BaseCommand):
+    help = 'Удаление изображений, на которые не ссылаются рецепты'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=24 * 60 * 60,
+            help='Не трогать файлы, загруженные за это число секунд',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Перед сборкой пересчитать ссылки по таблице рецептов',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+        )
+
+    def recount(self, batch_size):
+        """Исправляет счётчики по таблице рецептов на месте.
+
+        Строки MediaFile блокируются до подсчёта: изменения рецептов,
+        не видные подсчёту, ждут блокировки и применяются поверх.
+        """
+        with transaction.atomic():
+            list(MediaFile.objects.select_for_update().values_list('pk'))
+            references = Counter()
+            for image, variants in Recipe.objects.values_list(
+                'image', 'image_variants'
+            ).iterator():
+                references.update(recipe_media_names(image, variants))
+            MediaFile.objects.bulk_create(
+                (MediaFile(name=name) for name in references),
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            changed = [
+                media_file
+                for media_file in MediaFile.objects.only('name', 'references')
+                if media_file.references != references[media_file.name]
+            ]
+            for media_file in changed:
+                media_file.references = references[media_file.name]
+            MediaFile.objects.bulk_update(
+                changed, ['references'], batch_size=batch_size
+            )
+        self.stdout.write(f'Ссылки пересчитаны: исправлено {len(changed)}')
+
+    @transaction.atomic
+    def collect(self, batch, deadline, dry_run):
+        """Удаляет файлы batch без ссылок, не загружавшиеся с deadline.
+
+        Файлу без строки MediaFile она создаётся с текущей отметкой, и
+        он удаляется следующими запусками. Строки блокируются до конца
+        транзакции: загрузка того же файла ждёт удаления и пишет файл
+        заново, а начавшаяся раньше загрузка обновляет отметку.
+        """
+        if not dry_run:
+            MediaFile.objects.bulk_create(
+                [MediaFile(name=name) for name in batch],
+                ignore_conflicts=True,
+            )
+        garbage = list(MediaFile.objects.select_for_update().filter(
+            name__in=batch, references__lte=0, touched__lt=deadline
+        ).values_list('name', flat=True))
+        for name in garbage:
+            self.stdout.write(name)
+            if not dry_run:
+                try:
+                    os.unlink(batch[name])
+                except FileNotFoundError:
+                    pass
+        if not dry_run:
+            MediaFile.objects.filter(name__in=garbage).delete()
+        return len(garbage)
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.recount(options['batch_size'])
+        root = os.path.join(
+            settings.MEDIA_ROOT,
+            Recipe._meta.get_field('image').upload_to
+        )
+        if not os.path.isdir(root):
+            return
+        deadline = timezone.now() - timedelta(seconds=options['grace'])
+        removed = 0
+        batch = {}
+        for entry in scan_files(root):
+            if entry.name.startswith(TEMPORARY_PREFIX):
+                # Недописанные загрузки: у них нет строки MediaFile.
+                modified = entry.stat(follow_symlinks=False).st_mtime
+                if modified < deadline.timestamp():
+                    removed += 1
+                    if not options['dry_run']:
+                        os.unlink(entry.path)
+                continue
+            name = os.path.relpath(
+                entry.path, settings.MEDIA_ROOT
+            ).replace(os.sep, '/')
+            batch[name] = entry.path
+            if len(batch) >= options['batch_size']:
+                removed += self.collect(batch, deadline, options['dry_run'])
+                batch = {}
+        if batch:
+            removed += self.collect(batch, deadline, options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено файлов: {removed}!'
+        ))
@@ -0,0 +1,271 @@
+import io
+import itertools
+import random
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientAmount,
+    Recipe,
+    ShoppingCart,
+    Tag,
+    change_media_references,
+)
+from recipes.pantry import recipe_ingredient_index
+from recipes.search import update_search_vectors
+from users.models import Follow
+
+User = get_user_model()
+
+BATCH_SIZE = 2000
+
+
+def cumulative_zipf(size, alpha, rng):
+    """Накопленные веса Zipf для size объектов в случайном порядке.
+
+    Возвращает веса для random.choices(cum_weights=...): объект
+    с рангом r выбирается с вероятностью, пропорциональной 1 / r ** alpha.
+    """
+    weights = [1 / rank ** alpha for rank in range(1, size + 1)]
+    rng.shuffle(weights)
+    return list(itertools.accumulate(weights))
+
+
+def sample(rng, population, cum_weights, count, exclude=None):
+    """До count различных объектов population с учётом весов."""
+    count = min(count, len(population) - (1 if exclude is not None else 0))
+    chosen = set()
+    for _ in range(10):
+        if len(chosen) >= count:
+            break
+        chosen.update(rng.choices(
+            population, cum_weights=cum_weights, k=count - len(chosen)
+        ))
+        chosen.discard(exclude)
+    return list(chosen)[:count]
+
+
+def pareto_count(rng, alpha, limit):
+    """Число с тяжёлым хвостом: у большинства мало, у немногих много."""
+    return min(int(rng.paretovariate(alpha)) - 1, limit)
+
+
+class Command(BaseCommand):
+    help = 'Генерация синтетических данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix',
+            default='bench',
+            help='Префикс имён и почт создаваемых пользователей',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Удалить пользователей с этим префиксом и их данные',
+        )
+        parser.add_argument('--max-follows', type=int, default=200)
+        parser.add_argument('--max-favorites', type=int, default=300)
+        parser.add_argument('--max-cart', type=int, default=20)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument(
+            '--media-root',
+            help='Каталог для файлов рецептов, по умолчанию временный',
+        )
+
+    def handle(self, *args, **options):
+        # Картинки синтетических рецептов не должны попадать в MEDIA_ROOT
+        # проекта.
+        media_root = options['media_root'] or tempfile.mkdtemp(
+            prefix='foodgram-media-'
+        )
+        with override_settings(MEDIA_ROOT=media_root):
+            self.generate(options)
+        self.stdout.write(f'Файлы рецептов: {media_root}')
+
+    def generate(self, options):
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        users = User.objects.filter(username__startswith=f'{prefix}_')
+        if options['clear']:
+            Recipe.objects.filter(author__in=users).delete()
+            users.delete()
+        elif users.exists():
+            raise CommandError(
+                f'Пользователи {prefix}_* уже есть, используйте --clear'
+            )
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError('Сначала загрузите ингредиенты и теги')
+
+        user_ids = self.create_users(prefix, options['users'])
+        recipe_ids = self.create_recipes(
+            rng, user_ids, ingredient_ids, tag_ids, options
+        )
+        self.create_graphs(rng, user_ids, recipe_ids, options)
+        recipe_ingredient_index.invalidate()
+        call_command('rebuild_shopping_cart_totals', stdout=io.StringIO())
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}!'
+        ))
+
+    def create_users(self, prefix, count):
+        password = make_password(prefix)
+        with transaction.atomic():
+            User.objects.bulk_create(
+                (
+                    User(
+                        username=f'{prefix}_{number}',
+                        email=f'{prefix}_{number}@example.com',
+                        first_name='Имя',
+                        last_name=f'Фамилия {number}',
+                        password=password,
+                    )
+                    for number in range(count)
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        return list(User.objects.filter(
+            username__startswith=f'{prefix}_'
+        ).order_by('id').values_list('id', flat=True))
+
+    def save_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'JPEG')
+        return default_storage.save(
+            Recipe._meta.get_field('image').upload_to + 'bench.jpg',
+            ContentFile(buffer.getvalue())
+        )
+
+    def create_recipes(self, rng, user_ids, ingredient_ids, tag_ids,
+                       options):
+        image = self.save_image()
+        author_weights = cumulative_zipf(len(user_ids), 1.1, rng)
+        authors = rng.choices(
+            user_ids, cum_weights=author_weights, k=options['recipes']
+        )
+        now = timezone.now()
+        with transaction.atomic():
+            recipes = Recipe.objects.bulk_create(
+                (
+                    Recipe(
+                        author_id=author_id,
+                        name=f'Рецепт {number}',
+                        text='Описание рецепта. ' * rng.randint(5, 40),
+                        cooking_time=rng.randint(5, 180),
+                        image=image,
+                    )
+                    for number, author_id in enumerate(authors)
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            if not recipes or recipes[0].pk is None:
+                recipes = list(Recipe.objects.filter(
+                    author__username__startswith=f'{options["prefix"]}_'
+                ).order_by('id'))
+            for recipe in recipes:
+                recipe.created = recipe.updated = now - timedelta(
+                    seconds=rng.randint(0, options['days'] * 24 * 60 * 60)
+                )
+            Recipe.objects.bulk_update(
+                recipes, ['created', 'updated'], batch_size=BATCH_SIZE
+            )
+            change_media_references([image], len(recipes))
+            IngredientAmount.objects.bulk_create(
+                (
+                    IngredientAmount(
+                        recipe_id=recipe.id,
+                        ingredient_id=ingredient_id,
+                        amount=rng.randint(1, 500),
+                    )
+                    for recipe in recipes
+                    for ingredient_id in rng.sample(
+                        ingredient_ids,
+                        min(rng.randint(3, 15), len(ingredient_ids))
+                    )
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            recipe_tag = Recipe.tags.through
+            recipe_tag.objects.bulk_create(
+                (
+                    recipe_tag(recipe_id=recipe.id, tag_id=tag_id)
+                    for recipe in recipes
+                    for tag_id in rng.sample(
+                        tag_ids, min(rng.randint(1, 3), len(tag_ids))
+                    )
+                ),
+                batch_size=BATCH_SIZE,
+            )
+            update_search_vectors(Recipe.objects.filter(
+                author__username__startswith=f'{options["prefix"]}_'
+            ))
+        return [recipe.id for recipe in recipes]
+
+    def create_graphs(self, rng, user_ids, recipe_ids, options):
+        author_weights = cumulative_zipf(len(user_ids), 1.1, rng)
+        recipe_weights = cumulative_zipf(len(recipe_ids), 1.0, rng)
+        follows = []
+        favorites = []
+        cart = []
+        for user_id in user_ids:
+            follows.extend(
+                Follow(user_id=user_id, author_id=author_id)
+                for author_id in sample(
+                    rng, user_ids, author_weights,
+                    pareto_count(rng, 1.2, options['max_follows']),
+                    exclude=user_id
+                )
+            )
+            favorites.extend(
+                Favorite(user_id=user_id, recipe_id=recipe_id)
+                for recipe_id in sample(
+                    rng, recipe_ids, recipe_weights,
+                    pareto_count(rng, 1.1, options['max_favorites'])
+                )
+            )
+            cart.extend(
+                ShoppingCart(user_id=user_id, recipe_id=recipe_id)
+                for recipe_id in sample(
+                    rng, recipe_ids, recipe_weights,
+                    pareto_count(rng, 1.5, options['max_cart'])
+                )
+            )
+        now = timezone.now()
+        with transaction.atomic():
+            for model, rows in (
+                (Follow, follows),
+                (Favorite, favorites),
+                (ShoppingCart, cart),
+            ):
+                model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            for model in (Favorite, ShoppingCart):
+                rows = list(model.objects.filter(
+                    user_id__in=user_ids
+                ).only('id').order_by('id'))
+                for row in rows:
+                    row.created = now - timedelta(
+                        seconds=rng.randint(0, options['days'] * 24 * 60 * 60)
+                    )
+                model.objects.bulk_update(
+                    rows, ['created'], batch_size=BATCH_SIZE
+                )
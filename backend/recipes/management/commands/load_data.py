@@ -1,30 +1,193 @@
 import csv
+import itertools
 
 from django.conf import settings
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.cache import TAGS, bump_version
 from recipes.models import Ingredient, Tag
+from recipes.search import ingredient_index
+
+INGREDIENT_FIELDS = ('name', 'measurement_unit')
+TAG_FIELDS = ('name', 'color', 'slug')
+
+
+def read_header(file, fields):
+    header = [
+        column.strip() for column in next(csv.reader([file.readline()]))
+    ]
+    if tuple(header) != fields:
+        raise CommandError(
+            f'{file.name}: ожидались столбцы {", ".join(fields)}, '
+            f'получены {", ".join(header)}'
+        )
+
+
+def read_rows(file, fields):
+    """Строки CSV без заголовка в виде кортежей без лишних пробелов."""
+    read_header(file, fields)
+    for row in csv.reader(file):
+        yield tuple(value.strip() for value in row)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
 
 
 class Command(BaseCommand):
-    help = 'Загрузка из csv файла'
-
-    def handle(self, *args, **kwargs):
-        data_path = settings.BASE_DIR
-        with open(
-            f'{data_path}/data/ingredients.csv',
-            'r',
-            encoding='utf-8'
-        ) as file:
-            reader = csv.DictReader(file)
+    help = 'Загрузка и обновление ингредиентов и тегов из csv файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients',
+            default=settings.BASE_DIR / 'data' / 'ingredients.csv',
+        )
+        parser.add_argument(
+            '--tags',
+            default=settings.BASE_DIR / 'data' / 'tags.csv',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Не использовать COPY даже на PostgreSQL',
+        )
+
+    def handle(self, *args, **options):
+        with open(options['ingredients'], encoding='utf-8') as file:
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                counts = self.copy_ingredients(file)
+            else:
+                counts = self.upsert_ingredients(file, options['batch_size'])
+        if counts['добавлено']:
+            ingredient_index.invalidate()
+        self.report('Ингредиенты', counts)
+        with open(options['tags'], encoding='utf-8') as file:
+            counts = self.upsert_tags(file)
+        if counts['добавлено'] or counts['изменено']:
+            bump_version(TAGS)
+        self.report('Теги', counts)
+
+    def report(self, title, counts):
+        self.stdout.write(self.style.SUCCESS(
+            f'{title}: ' + ', '.join(
+                f'{label} {count}' for label, count in counts.items()
+            )
+        ))
+
+    def is_valid(self, model, fields, row):
+        return len(row) == len(fields) and all(
+            0 < len(value) <= model._meta.get_field(field).max_length
+            for field, value in zip(fields, row)
+        )
+
+    def upsert_ingredients(self, file, batch_size):
+        """Пакетная загрузка через ORM для любой СУБД.
+
+        Ключ ингредиента - пара (название, единица измерения), поэтому
+        строку можно только добавить или оставить как есть.
+        """
+        counts = {'добавлено': 0, 'без изменений': 0, 'пропущено': 0}
+        for batch in batches(read_rows(file, INGREDIENT_FIELDS), batch_size):
+            valid = [
+                row for row in batch
+                if self.is_valid(Ingredient, INGREDIENT_FIELDS, row)
+            ]
+            counts['пропущено'] += len(batch) - len(valid)
+            rows = set(valid)
+            existing = set(Ingredient.objects.filter(
+                name__in={name for name, _ in rows}
+            ).values_list(*INGREDIENT_FIELDS))
+            new = rows - existing
             Ingredient.objects.bulk_create(
-                Ingredient(**data) for data in reader)
-        self.stdout.write(self.style.SUCCESS('Все ингридиенты загружены!'))
-        with open(
-            f'{data_path}/data/tags.csv',
-            'r',
-            encoding='utf-8'
-        ) as file:
-            reader = csv.DictReader(file)
-            Tag.objects.bulk_create(
-                Tag(**data) for data in reader)
-        self.stdout.write(self.style.SUCCESS('Все теги загружены!'))
+                (
+                    Ingredient(name=name, measurement_unit=unit)
+                    for name, unit in new
+                ),
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            counts['добавлено'] += len(new)
+            counts['без изменений'] += len(valid) - len(new)
+        return counts
+
+    @transaction.atomic
+    def copy_ingredients(self, file):
+        """Загрузка на PostgreSQL: COPY во временную таблицу и один INSERT.
+
+        Файл передаётся в COPY потоком, память не зависит от его размера.
+        """
+        table = Ingredient._meta.db_table
+        name_length = Ingredient._meta.get_field('name').max_length
+        unit_length = Ingredient._meta.get_field(
+            'measurement_unit'
+        ).max_length
+        read_header(file, INGREDIENT_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name text, measurement_unit text) ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                file
+            )
+            cursor.execute('SELECT count(*) FROM ingredient_import')
+            total, = cursor.fetchone()
+            valid = (
+                'length(btrim(name)) BETWEEN 1 AND %s '
+                'AND length(btrim(measurement_unit)) BETWEEN 1 AND %s'
+            )
+            cursor.execute(
+                'SELECT count(*) FROM ingredient_import '
+                f'WHERE {valid}',
+                [name_length, unit_length]
+            )
+            skipped = total - cursor.fetchone()[0]
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT btrim(name), btrim(measurement_unit) '
+                f'FROM ingredient_import WHERE {valid} '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING',
+                [name_length, unit_length]
+            )
+            inserted = cursor.rowcount
+        return {
+            'добавлено': inserted,
+            'без изменений': total - skipped - inserted,
+            'пропущено': skipped,
+        }
+
+    @transaction.atomic
+    def upsert_tags(self, file):
+        """Теги сопоставляются по slug, название и цвет обновляются."""
+        counts = {
+            'добавлено': 0, 'изменено': 0, 'без изменений': 0, 'пропущено': 0
+        }
+        existing = Tag.objects.in_bulk(field_name='slug')
+        new = {}
+        changed = {}
+        for row in read_rows(file, TAG_FIELDS):
+            if not self.is_valid(Tag, TAG_FIELDS, row):
+                counts['пропущено'] += 1
+                continue
+            name, color, slug = row
+            tag = existing.get(slug)
+            if tag is None:
+                new[slug] = Tag(name=name, color=color, slug=slug)
+            elif (tag.name, tag.color) != (name, color):
+                tag.name, tag.color = name, color
+                changed[slug] = tag
+            else:
+                counts['без изменений'] += 1
+        Tag.objects.bulk_create(new.values())
+        Tag.objects.bulk_update(changed.values(), ['name', 'color'])
+        counts['добавлено'] = len(new)
+        counts['изменено'] = len(changed)
+        return counts
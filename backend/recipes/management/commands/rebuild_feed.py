@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+from recipes.feed import rebuild_feed
+from users.models import Follow
+
+
+class Command(BaseCommand):
+    help = 'Заполнение лент подписчиков по текущим подпискам'
+
+    def handle(self, *args, **options):
+        user_ids = Follow.objects.order_by('user_id').values_list(
+            'user_id', flat=True
+        ).distinct()
+        count = 0
+        for user_id in user_ids.iterator():
+            rebuild_feed(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты заполнены: {count}!'
+        ))
@@ -0,0 +1,79 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from recipes.models import IngredientAmount, ShoppingCartTotal
+
+
+class Command(BaseCommand):
+    help = 'Пересборка или проверка итогов списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сравнить итоги с пересчётом, ничего не меняя',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+        )
+
+    def expected_totals(self):
+        # filter до values: иначе Django присоединяет корзину второй раз
+        # и суммы умножаются на число владельцев рецепта в корзине.
+        rows = IngredientAmount.objects.filter(
+            recipe__recipe_in_shopping_cart__isnull=False
+        ).values(
+            'recipe__recipe_in_shopping_cart__user', 'ingredient'
+        ).annotate(
+            total=Sum('amount')
+        ).order_by()
+        return {
+            (row['recipe__recipe_in_shopping_cart__user'],
+             row['ingredient']): row['total']
+            for row in rows.iterator()
+        }
+
+    def handle(self, *args, **options):
+        expected = self.expected_totals()
+        if options['check']:
+            actual = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingCartTotal.objects.values_list(
+                    'user', 'ingredient', 'amount'
+                ).iterator()
+            }
+            mismatches = [
+                key for key in expected.keys() | actual.keys()
+                if expected.get(key) != actual.get(key)
+            ]
+            for user_id, ingredient_id in mismatches[:20]:
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'ожидалось {expected.get((user_id, ingredient_id))}, '
+                    f'в таблице {actual.get((user_id, ingredient_id))}'
+                )
+            if mismatches:
+                raise CommandError(
+                    f'Расхождений в итогах: {len(mismatches)}'
+                )
+            self.stdout.write(self.style.SUCCESS('Итоги совпадают!'))
+            return
+        with transaction.atomic():
+            ShoppingCartTotal.objects.all().delete()
+            ShoppingCartTotal.objects.bulk_create(
+                (
+                    ShoppingCartTotal(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount
+                    )
+                    for (user_id, ingredient_id), amount in expected.items()
+                ),
+                batch_size=options['batch_size'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Итоги пересобраны: {len(expected)} строк!'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Проверка и исправление счётчиков избранного, подписчиков и др.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только найти расхождения, ничего не меняя',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+        )
+
+    def handle(self, *args, **options):
+        result = reconcile_counters(
+            batch_size=options['batch_size'], check=options['check']
+        )
+        for counter, drifted in result.items():
+            self.stdout.write(f'{counter}: расхождений {drifted}')
+        total = sum(result.values())
+        if options['check'] and total:
+            raise CommandError(f'Расхождений в счётчиках: {total}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено: {total}!' if total else 'Счётчики совпадают!'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+from django.utils import timezone
+from recipes.trending import update_activity, update_rankings
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт суточной активности и рейтингов популярных рецептов, '
+        'запускается периодически'
+    )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        rows = update_activity(now)
+        sizes = update_rankings(now)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено строк активности: {rows}, рейтинги: ' + ', '.join(
+                f'{period} {size}' for period, size in sizes.items()
+            )
+        ))
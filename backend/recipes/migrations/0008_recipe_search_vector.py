@@ -0,0 +1,98 @@
+# Generated by Django 3.2.16 on 2026-10-18 09:40
+
+import itertools
+from collections import defaultdict
+
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+INDEX_NAME = 'recipes_recipe_search_vector_gin'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX {INDEX_NAME} ON recipes_recipe '
+            'USING gin (search_vector)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+# Копия recipes.search на момент миграции: код приложения может
+# измениться, а миграция должна давать тот же результат.
+SEARCH_CONFIG = 'russian'
+SECTION = '\n'
+BATCH_SIZE = 1000
+
+
+def fill_search_vectors(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientAmount = apps.get_model('recipes', 'IngredientAmount')
+    recipes = Recipe.objects.using(schema_editor.connection.alias)
+    amounts = IngredientAmount.objects.using(schema_editor.connection.alias)
+    if schema_editor.connection.vendor == 'postgresql':
+        ingredient_names = Subquery(
+            amounts.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names')
+        )
+        recipes.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(ingredient_names, weight='B', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+        return
+    rows = recipes.order_by().values_list('id', 'name', 'text').iterator()
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        ingredient_names = defaultdict(list)
+        for recipe_id, name in amounts.filter(
+            recipe_id__in=[recipe_id for recipe_id, _, _ in batch]
+        ).values_list('recipe_id', 'ingredient__name'):
+            ingredient_names[recipe_id].append(name)
+        recipes.bulk_update(
+            [
+                Recipe(
+                    id=recipe_id,
+                    search_vector=SECTION.join(
+                        (name, ' '.join(ingredient_names[recipe_id]), text)
+                    ).lower()
+                )
+                for recipe_id, name, text in batch
+            ],
+            ['search_vector'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_mediafile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            fill_search_vectors,
+            migrations.RunPython.noop,
+        ),
+        migrations.RunPython(
+            create_search_index,
+            drop_search_index,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:24
+
+from django.db import migrations, models
+
+INGREDIENT_NAME_INDEX = 'ingredient_upper_name_idx'
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    # istartswith на PostgreSQL - UPPER(name) LIKE UPPER(%s): индекс по
+    # выражению с varchar_pattern_ops подходит для LIKE при любой локали.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX {INGREDIENT_NAME_INDEX} ON recipes_ingredient '
+            '(UPPER(name::text) varchar_pattern_ops)'
+        )
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'DROP INDEX IF EXISTS {INGREDIENT_NAME_INDEX}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-created', 'id'], include=('author', 'updated'), name='recipe_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-created'], include=('updated',), name='recipe_author_created_idx'),
+        ),
+        migrations.RunPython(
+            create_ingredient_name_index,
+            drop_ingredient_name_index,
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Копия recipes.counters на момент миграции: (модель, поле, считаемая
+# модель, ссылка).
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.Favorite', 'recipe'),
+    (
+        'recipes.Recipe', 'shopping_cart_count',
+        'recipes.ShoppingCart', 'recipe'
+    ),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'author'),
+)
+
+
+def fill(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    for model, field, related, link in COUNTERS:
+        actual = Coalesce(
+            Subquery(
+                apps.get_model(related).objects.filter(
+                    **{link: OuterRef('pk')}
+                ).order_by().values(link).annotate(
+                    count=Count('pk')
+                ).values('count')
+            ),
+            0
+        )
+        apps.get_model(model).objects.using(alias).update(**{field: actual})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_indexes'),
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-created', 'id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunPython(fill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRecommendations',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recommendations', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('neighbors', models.JSONField(default=list, verbose_name='Рецепты')),
+                ('scores', models.JSONField(default=list, verbose_name='Сходство')),
+                ('built', models.DateTimeField(verbose_name='Построено')),
+            ],
+            options={
+                'verbose_name': 'Рекомендации',
+                'verbose_name_plural': 'Рекомендации',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:09
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_reciperecommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='touched',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последняя загрузка'),
+        ),
+    ]
@@ -1,7 +1,25 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
 from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
+from users.models import Follow, with_is_subscribed
+
+from .counters import CountersModelMixin
 
 User = get_user_model()
 
@@ -78,7 +96,76 @@ class IngredientAmount(models.Model):
         return f'{self.ingredient} - {self.amount}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Набор рецептов с подготовленными данными для чтения."""
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги пользователя и подгружает связанные объекты.
+
+        Количество запросов не зависит от числа рецептов в выборке.
+        """
+        authors = with_is_subscribed(User.objects.all(), user)
+        if user.is_anonymous:
+            false = Value(False, output_field=BooleanField())
+            queryset = self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+            )
+        else:
+            queryset = self.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+            )
+        return queryset.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'ingredientamount',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient'
+                )
+            ),
+        )
+
+    def latest_per_author(self, limit=None):
+        """Не больше limit последних рецептов каждого автора.
+
+        Ограничение выполняется в SQL коррелированным подзапросом,
+        поэтому для любого числа авторов нужен один запрос.
+        """
+        if limit is None:
+            return self
+        if limit <= 0:
+            return self.none()
+        return self.filter(id__in=Subquery(
+            self.model.objects.filter(
+                author=OuterRef('author')
+            ).values('id')[:limit]
+        ))
+
+    def versions(self, user):
+        """Рецепты только с полями, от которых зависит их вид для user.
+
+        Применяется к результату with_user_flags и нужен для ETag:
+        один лёгкий запрос без подгрузки связанных объектов.
+        """
+        if user.is_anonymous:
+            is_subscribed = Value(False, output_field=BooleanField())
+        else:
+            is_subscribed = Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author')
+            ))
+        return self.prefetch_related(None).annotate(
+            author_is_subscribed=is_subscribed,
+            author_updated=F('author__updated'),
+        ).only('id', 'author', 'created', 'updated')
+
+
+class Recipe(CountersModelMixin, models.Model):
     """Модель рецептов."""
     author = models.ForeignKey(
         User,
@@ -91,6 +178,11 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         null=False,
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Варианты изображения',
+    )
     text = models.TextField(verbose_name='Текст')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -120,15 +212,67 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
+    favorites_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    shopping_cart_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(
+                fields=['-created', 'id'],
+                include=['author', 'updated'],
+                name='recipe_created_id_idx',
+            ),
+            models.Index(
+                fields=['author', '-created'],
+                include=['updated'],
+                name='recipe_author_created_idx',
+            ),
+            models.Index(
+                fields=['-favorites_count', '-created', 'id'],
+                name='recipe_popular_idx',
+            ),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
     def __str__(self):
         return self.name
 
+    @property
+    def version(self):
+        """Значения, однозначно задающие вид рецепта для пользователя.
+
+        Требует аннотаций из RecipeQuerySet.versions.
+        """
+        return (
+            self.id,
+            self.updated,
+            self.author_updated,
+            self.is_favorited,
+            self.is_in_shopping_cart,
+            self.author_is_subscribed,
+        )
+
 
 class Favorite(models.Model):
     """Модель избранных рецептов."""
@@ -144,6 +288,12 @@ class Favorite(models.Model):
         related_name='favorite_recipe',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        null=True,
+        db_index=True,
+        verbose_name='Добавлено'
+    )
 
     class Meta:
         unique_together = ('user', 'recipe')
@@ -165,8 +315,288 @@ class ShoppingCart(models.Model):
         related_name='recipe_in_shopping_cart',
         verbose_name='Рецепт'
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        null=True,
+        db_index=True,
+        verbose_name='Добавлено'
+    )
 
     class Meta:
         unique_together = ('user', 'recipe')
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+
+
+class ShoppingCartTotalQuerySet(models.QuerySet):
+    """Инкрементальное обновление итогов списка покупок."""
+
+    def apply(self, user_ids, deltas):
+        """Прибавляет к итогам пользователей изменения {ingredient_id: кол-во}.
+
+        Строки, в которых количество стало нулевым, удаляются.
+        """
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not deltas:
+            return
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        # Внутри транзакции вызывающего кода точка сохранения не нужна:
+        # ошибка всё равно откатывает всю транзакцию.
+        with transaction.atomic(savepoint=False):
+            self.bulk_create(
+                [
+                    self.model(user_id=user_id, ingredient_id=ingredient_id)
+                    for user_id in user_ids
+                    for ingredient_id in deltas
+                ],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            totals = self.filter(
+                user_id__in=user_ids,
+                ingredient_id__in=deltas
+            )
+            totals.update(amount=F('amount') + Case(
+                *[
+                    When(ingredient_id=ingredient_id, then=Value(delta))
+                    for ingredient_id, delta in deltas.items()
+                ],
+                default=Value(0),
+                output_field=IntegerField(),
+            ))
+            totals.filter(amount__lte=0).delete()
+
+    def add_recipes(self, user_ids, recipes):
+        self.apply(user_ids, recipe_amounts(recipes))
+
+    def remove_recipes(self, user_ids, recipes):
+        self.apply(user_ids, {
+            ingredient_id: -amount
+            for ingredient_id, amount in recipe_amounts(recipes).items()
+        })
+
+
+def recipe_amounts(recipes):
+    """Суммарные количества ингредиентов рецептов {ingredient_id: кол-во}.
+
+    recipes - рецепты или их id.
+    """
+    return dict(IngredientAmount.objects.filter(
+        recipe__in=recipes
+    ).order_by().values('ingredient_id').annotate(
+        total=Sum('amount')
+    ).values_list('ingredient_id', 'total'))
+
+
+class ShoppingCartTotal(models.Model):
+    """Итоговое количество ингредиента в списке покупок пользователя.
+
+    Денормализованная сумма IngredientAmount по рецептам из ShoppingCart,
+    пересобирается командой rebuild_shopping_cart_totals.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals',
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField(default=0, verbose_name='Кол-во')
+
+    objects = ShoppingCartTotalQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('user', 'ingredient')
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списка покупок'
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+class MediaFile(models.Model):
+    """Счётчик рецептов, ссылающихся на файл в хранилище.
+
+    Файлы с нулевым счётчиком, не загружавшиеся дольше grace-периода,
+    удаляет команда collect_media_garbage.
+    """
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Имя файла'
+    )
+    references = models.IntegerField(default=0, verbose_name='Ссылок')
+    touched = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Последняя загрузка'
+    )
+
+    class Meta:
+        verbose_name = 'Медиафайл'
+        verbose_name_plural = 'Медиафайлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.references})'
+
+
+class RecipeActivity(models.Model):
+    """Добавления рецепта в избранное и списки покупок за сутки.
+
+    Агрегат за окно TRENDING_WINDOW_DAYS, из которого команда
+    update_trending считает оценки популярности.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='activity',
+        verbose_name='Рецепт'
+    )
+    day = models.DateField(verbose_name='День')
+    favorites = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В избранное'
+    )
+    carts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='В списки покупок'
+    )
+
+    class Meta:
+        unique_together = ('recipe', 'day')
+        indexes = [
+            models.Index(fields=['day'], name='recipe_activity_day_idx'),
+        ]
+        verbose_name = 'Активность по рецепту'
+        verbose_name_plural = 'Активность по рецептам'
+
+    def __str__(self):
+        return f'{self.recipe} {self.day}: {self.favorites}/{self.carts}'
+
+
+class TrendingRecipe(models.Model):
+    """Готовый рейтинг рецептов, позиция rank начинается с 1."""
+    TRENDING = 'trending'
+    WEEK = 'week'
+    PERIODS = (
+        (TRENDING, 'Набирающие популярность'),
+        (WEEK, 'Популярное за неделю'),
+    )
+    period = models.CharField(
+        max_length=16,
+        choices=PERIODS,
+        verbose_name='Рейтинг'
+    )
+    rank = models.PositiveIntegerField(verbose_name='Место')
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='trending',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(verbose_name='Оценка')
+
+    class Meta:
+        ordering = ('period', 'rank')
+        unique_together = ('period', 'rank')
+        verbose_name = 'Место в рейтинге'
+        verbose_name_plural = 'Рейтинги рецептов'
+
+    def __str__(self):
+        return f'{self.period} #{self.rank}: {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """Рецепт автора в ленте подписчика (хранилище ленты в БД)."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт'
+    )
+    created = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        unique_together = ('user', 'recipe')
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-recipe'],
+                name='feed_entry_user_created_idx',
+            ),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+
+
+class RecipeRecommendations(models.Model):
+    """Похожие рецепты по совместным добавлениям, лучшие первыми.
+
+    Строится командой build_recommendations.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recommendations',
+        verbose_name='Рецепт'
+    )
+    neighbors = models.JSONField(default=list, verbose_name='Рецепты')
+    scores = models.JSONField(default=list, verbose_name='Сходство')
+    built = models.DateTimeField(verbose_name='Построено')
+
+    class Meta:
+        verbose_name = 'Рекомендации'
+        verbose_name_plural = 'Рекомендации'
+
+
+def recipe_media_names(image, image_variants):
+    """Имена всех файлов изображения рецепта, включая варианты."""
+    names = {
+        name
+        for variants in (image_variants or {}).values()
+        for name in variants.values()
+    }
+    if image:
+        names.add(str(image))
+    return names
+
+
+def touch_media_file(name):
+    """Отмечает загрузку файла name до записи его в хранилище.
+
+    Строка блокируется до конца транзакции загрузки, поэтому сборщик
+    мусора либо дождётся её и увидит свежую отметку, либо удалит файл
+    раньше, и загрузка запишет его заново.
+    """
+    MediaFile.objects.update_or_create(
+        name=name, defaults={'touched': timezone.now()}
+    )
+
+
+def change_media_references(names, delta):
+    """Меняет счётчики ссылок на файлы names на delta."""
+    if not names or not delta:
+        return
+    if delta > 0:
+        MediaFile.objects.bulk_create(
+            [MediaFile(name=name) for name in names],
+            ignore_conflicts=True,
+        )
+    MediaFile.objects.filter(name__in=names).update(
+        references=F('references') + delta
+    )
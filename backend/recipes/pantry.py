@@ -0,0 +1,114 @@
+import threading
+from collections import Counter, defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import RECIPE_INGREDIENTS, bump_version, get_version
+from .models import IngredientAmount, Recipe
+
+Match = namedtuple('Match', 'recipe_id matched missing jaccard')
+
+
+class RecipeIngredientIndex:
+    """Подбор рецептов по имеющимся ингредиентам в памяти процесса.
+
+    Инвертированный индекс: ингредиент -> множество id рецептов с ним,
+    и обратный: рецепт -> множество его ингредиентов. При изменении
+    версии RECIPE_INGREDIENTS в кэше процесс догружает только рецепты,
+    изменённые после прошлой синхронизации (с запасом sync_margin
+    на долгие транзакции), и убирает удалённые.
+    """
+    sync_margin = timedelta(minutes=1)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.synced = None
+        self.recipes = {}
+        self.postings = defaultdict(set)
+
+    def invalidate(self):
+        """Помечает индексы всех процессов устаревшими после коммита."""
+        transaction.on_commit(lambda: bump_version(RECIPE_INGREDIENTS))
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        for ingredient_id in self.recipes.get(recipe_id, ()):
+            if ingredient_id not in ingredient_ids:
+                self.postings[ingredient_id].discard(recipe_id)
+        for ingredient_id in ingredient_ids:
+            self.postings[ingredient_id].add(recipe_id)
+        self.recipes[recipe_id] = frozenset(ingredient_ids)
+
+    def remove_recipe(self, recipe_id):
+        for ingredient_id in self.recipes.pop(recipe_id, ()):
+            self.postings[ingredient_id].discard(recipe_id)
+
+    def load(self, recipes):
+        """Перечитывает ингредиенты рецептов из queryset recipes."""
+        ingredients = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientAmount.objects.filter(
+            recipe__in=recipes
+        ).values_list('recipe_id', 'ingredient_id').iterator():
+            ingredients[recipe_id].add(ingredient_id)
+        for recipe_id in recipes.values_list('id', flat=True):
+            self.set_recipe(recipe_id, ingredients[recipe_id])
+
+    def sync(self):
+        """Догружает изменения, вызывается под блокировкой."""
+        version = get_version(RECIPE_INGREDIENTS)
+        if self.version == version:
+            return
+        started = timezone.now()
+        if self.synced is None:
+            self.load(Recipe.objects.all())
+        else:
+            live = set(Recipe.objects.values_list('id', flat=True))
+            for recipe_id in self.recipes.keys() - live:
+                self.remove_recipe(recipe_id)
+            self.load(Recipe.objects.filter(
+                id__in=live - self.recipes.keys()
+            ) | Recipe.objects.filter(
+                updated__gte=self.synced - self.sync_margin
+            ))
+        self.synced = started
+        self.version = version
+
+    def match(self, ingredient_ids, max_missing=None):
+        """Рецепты, в которых есть хотя бы один из ingredient_ids.
+
+        Порядок: меньше недостающих ингредиентов, выше коэффициент
+        Жаккара между набором пользователя и ингредиентами рецепта.
+        """
+        with self._lock:
+            self.sync()
+            return self.rank(set(ingredient_ids), max_missing)
+
+    def rank(self, pantry, max_missing):
+        matched = Counter()
+        for ingredient_id in pantry:
+            matched.update(self.postings.get(ingredient_id, ()))
+        recipes = self.recipes
+        result = []
+        for recipe_id, count in matched.items():
+            size = len(recipes[recipe_id])
+            missing = size - count
+            if max_missing is not None and missing > max_missing:
+                continue
+            result.append(Match(
+                recipe_id, count, missing,
+                count / (size + len(pantry) - count)
+            ))
+        result.sort(key=lambda match: (
+            match.missing, -match.jaccard, -match.recipe_id
+        ))
+        return result
+
+    def missing_ingredients(self, recipe_id, ingredient_ids):
+        return sorted(self.recipes.get(recipe_id, frozenset()).difference(
+            ingredient_ids
+        ))
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
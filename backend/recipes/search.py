@@ -0,0 +1,327 @@
+import bisect
+import html
+import itertools
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connections
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, When
+
+from .cache import INGREDIENTS, bump_version, get_version
+from .models import Ingredient
+
+
+def trigrams(text):
+    """Триграммы строки с отступами, как в pg_trgm."""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def ngrams(text, max_size=3):
+    """Все различные подстроки длиной от 1 до max_size символов."""
+    return {
+        text[i:i + size]
+        for size in range(1, max_size + 1)
+        for i in range(len(text) - size + 1)
+    }
+
+
+class _Snapshot:
+    """Неизменяемый снимок индекса, собранный из таблицы ингредиентов."""
+
+    def __init__(self, version, rows):
+        self.version = version
+        rows = sorted(rows, key=lambda row: (row[1].lower(), row[2]))
+        self.keys = [name.lower() for _, name, _ in rows]
+        self.items = [
+            {'id': pk, 'name': name, 'measurement_unit': unit}
+            for pk, name, unit in rows
+        ]
+        self.gram_counts = []
+        self.grams = defaultdict(list)
+        self.ngrams = defaultdict(list)
+        for position, key in enumerate(self.keys):
+            key_grams = trigrams(key)
+            self.gram_counts.append(len(key_grams))
+            for gram in key_grams:
+                self.grams[gram].append(position)
+            for gram in ngrams(key):
+                self.ngrams[gram].append(position)
+
+
+class IngredientSearchIndex:
+    """Поиск ингредиентов по названию в памяти процесса.
+
+    Отсортированный список названий отвечает на поиск по префиксу,
+    триграммный индекс - на поиск подстроки и нечёткий поиск с опечатками.
+    Снимок пересобирается одним запросом при изменении версии
+    ингредиентов в кэше, которую увеличивают сигналы модели Ingredient.
+    """
+    fuzzy_threshold = 0.3
+    extra_limit = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        bump_version(INGREDIENTS)
+        self._snapshot = None
+
+    def get_snapshot(self):
+        version = get_version(INGREDIENTS)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = _Snapshot(
+                    version,
+                    Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'
+                    )
+                )
+                self._snapshot = snapshot
+        return snapshot
+
+    def search(self, query):
+        """Ингредиенты, подходящие под запрос, в порядке релевантности.
+
+        Сначала идут все совпадения по началу названия, затем не больше
+        extra_limit совпадений по подстроке и похожих по триграммам названий.
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+        snapshot = self.get_snapshot()
+        keys = snapshot.keys
+        start = bisect.bisect_left(keys, query)
+        end = bisect.bisect_left(keys, query + '\uffff', lo=start)
+        found = set(range(start, end))
+        result = list(range(start, end))
+
+        if len(query) < 2:
+            return [snapshot.items[position] for position in result]
+        postings = sorted(
+            (snapshot.ngrams.get(query[i:i + 3], ())
+             for i in range(max(len(query) - 2, 1))),
+            key=len
+        )
+        candidates = set(postings[0]).intersection(*postings[1:])
+        substring = [
+            position for position in candidates
+            if position not in found and query in keys[position]
+        ]
+        substring.sort(key=lambda position: (
+            keys[position].find(query), position
+        ))
+        substring = substring[:self.extra_limit]
+        found.update(substring)
+        result.extend(substring)
+
+        extra_limit = self.extra_limit - len(substring)
+        if len(query) < 3 or extra_limit <= 0:
+            return [snapshot.items[position] for position in result]
+        query_grams = trigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(snapshot.grams.get(gram, ()))
+        similar = []
+        for position, count in shared.items():
+            if position in found:
+                continue
+            similarity = count / (
+                len(query_grams) + snapshot.gram_counts[position] - count
+            )
+            if similarity >= self.fuzzy_threshold:
+                similar.append((-similarity, position))
+        similar.sort()
+        result.extend(position for _, position in similar[:extra_limit])
+        return [snapshot.items[position] for position in result]
+
+
+ingredient_index = IngredientSearchIndex()
+
+
+SEARCH_CONFIG = 'russian'
+HIGHLIGHT_START = '\ue000'
+HIGHLIGHT_STOP = '\ue001'
+SECTION = '\n'
+
+
+def is_postgresql(queryset):
+    return connections[queryset.db].vendor == 'postgresql'
+
+
+def search_vector(recipe_model):
+    """Выражение поискового вектора рецепта для PostgreSQL.
+
+    Вес A у названия, B у названий ингредиентов, C у описания.
+    """
+    amounts = recipe_model._meta.get_field('ingredientamount').related_model
+    ingredient_names = Subquery(
+        amounts.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def search_document(name, ingredient_names, text):
+    """Документ для поиска без PostgreSQL: разделы в нижнем регистре."""
+    return SECTION.join(
+        (name, ' '.join(ingredient_names), text)
+    ).lower()
+
+
+def update_search_vectors(recipes, batch_size=1000):
+    """Пересчитывает search_vector рецептов из queryset recipes."""
+    if is_postgresql(recipes):
+        recipes.update(search_vector=search_vector(recipes.model))
+        return
+    amounts = recipes.model._meta.get_field('ingredientamount').related_model
+    rows = recipes.order_by().values_list('id', 'name', 'text').iterator()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        ingredient_names = defaultdict(list)
+        for recipe_id, name in amounts.objects.filter(
+            recipe_id__in=[recipe_id for recipe_id, _, _ in batch]
+        ).values_list('recipe_id', 'ingredient__name'):
+            ingredient_names[recipe_id].append(name)
+        recipes.model.objects.bulk_update(
+            [
+                recipes.model(
+                    id=recipe_id,
+                    search_vector=search_document(
+                        name, ingredient_names[recipe_id], text
+                    )
+                )
+                for recipe_id, name, text in batch
+            ],
+            ['search_vector'],
+        )
+
+
+def search_terms(query):
+    return [term for term in query.lower().split() if term]
+
+
+def search_recipes(recipes, query):
+    """Рецепты, подходящие под запрос, по убыванию релевантности.
+
+    На PostgreSQL - полнотекстовый поиск с морфологией и ранжированием
+    ts_rank по GIN-индексу. На других СУБД - поиск подстрок, ранг по
+    разделу документа с первым вхождением: название, ингредиенты, текст.
+    """
+    if is_postgresql(recipes):
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return recipes.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-created', 'id')
+    terms = search_terms(query)
+    if not terms:
+        return recipes.none()
+    for term in terms:
+        recipes = recipes.filter(search_vector__contains=term)
+    ranks = {}
+    for recipe_id, document in recipes.values_list('id', 'search_vector'):
+        sections = document.split(SECTION, 2)
+        ranks[recipe_id] = sum(
+            next(
+                (3 - index for index, section in enumerate(sections)
+                 if term in section),
+                0
+            )
+            for term in terms
+        )
+    if not ranks:
+        return recipes.none()
+    return recipes.annotate(search_rank=Case(
+        *[When(id=recipe_id, then=rank) for recipe_id, rank in ranks.items()],
+        output_field=IntegerField(),
+    )).order_by('-search_rank', '-created', 'id')
+
+
+def mark_up(text):
+    """HTML с выделением совпадений тегом <b>."""
+    return html.escape(text).replace(
+        HIGHLIGHT_START, '<b>'
+    ).replace(HIGHLIGHT_STOP, '</b>')
+
+
+def highlight_fragment(text, terms, width=80):
+    pattern = re.compile(
+        '|'.join(re.escape(term) for term in terms), re.IGNORECASE
+    )
+    match = pattern.search(text)
+    start = max(match.start() - width, 0) if match else 0
+    fragment = text[start:start + 2 * width + 40]
+    return pattern.sub(
+        lambda found: f'{HIGHLIGHT_START}{found.group()}{HIGHLIGHT_STOP}',
+        fragment
+    )
+
+
+def highlight_recipes(recipes, query):
+    """Записывает в search_highlight рецептов выделенные совпадения.
+
+    search_highlight: {'name': html, 'text': html с фрагментом описания}.
+    """
+    if not recipes:
+        return
+    model = type(recipes[0])
+    ids = [recipe.id for recipe in recipes]
+    queryset = model.objects.filter(id__in=ids)
+    if is_postgresql(queryset):
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        options = {
+            'config': SEARCH_CONFIG,
+            'start_sel': HIGHLIGHT_START,
+            'stop_sel': HIGHLIGHT_STOP,
+        }
+        highlights = {
+            recipe_id: (name, text)
+            for recipe_id, name, text in queryset.annotate(
+                name_highlight=SearchHeadline(
+                    'name', search_query, highlight_all=True, **options
+                ),
+                text_highlight=SearchHeadline(
+                    'text', search_query, max_fragments=2, **options
+                ),
+            ).values_list('id', 'name_highlight', 'text_highlight')
+        }
+    else:
+        terms = search_terms(query)
+        highlights = {
+            recipe.id: (
+                highlight_fragment(recipe.name, terms, len(recipe.name)),
+                highlight_fragment(recipe.text, terms),
+            )
+            for recipe in recipes
+        }
+    for recipe in recipes:
+        name, text = highlights.get(recipe.id, (recipe.name, recipe.text))
+        recipe.search_highlight = {
+            'name': mark_up(name), 'text': mark_up(text)
+        }
@@ -0,0 +1,72 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import TAGS, bump_version
+from .models import (
+    Ingredient,
+    Recipe,
+    Tag,
+    change_media_references,
+    recipe_media_names,
+)
+from .pantry import recipe_ingredient_index
+from .search import ingredient_index, update_search_vectors
+
+SEARCH_FIELDS = {'name', 'text'}
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_recipes_search(instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(instance, update_fields, **kwargs):
+    """Пересчитывает поисковый вектор после изменения названия или текста.
+
+    Ингредиенты, добавленные после сохранения рецепта, учитывает тот,
+    кто их добавляет: сериализатор, админка, generate_data.
+    """
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        update_search_vectors(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version(TAGS)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe_ingredient_index(**kwargs):
+    recipe_ingredient_index.invalidate()
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_media(instance, **kwargs):
+    old = Recipe.objects.filter(pk=instance.pk).values_list(
+        'image', 'image_variants'
+    ).first()
+    instance._old_media_names = recipe_media_names(*old) if old else set()
+
+
+@receiver(post_save, sender=Recipe)
+def count_recipe_media(instance, **kwargs):
+    old = getattr(instance, '_old_media_names', set())
+    new = recipe_media_names(instance.image.name, instance.image_variants)
+    change_media_references(new - old, 1)
+    change_media_references(old - new, -1)
+    instance._old_media_names = new
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_media(instance, **kwargs):
+    change_media_references(
+        recipe_media_names(instance.image.name, instance.image_variants),
+        -1
+    )
@@ -0,0 +1,54 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+from .models import touch_media_file
+
+TEMPORARY_PREFIX = '.tmp-'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище с именами по SHA-256 содержимого.
+
+    Файл сохраняется как <каталог>/<sha256><расширение>, поэтому
+    одинаковые загрузки ложатся в один файл. Перед записью загрузка
+    отмечается в строке MediaFile, чтобы сборщик мусора
+    collect_media_garbage не удалил файл в течение grace-периода.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        digest = hashlib.sha256()
+        handle, temporary_path = tempfile.mkstemp(
+            dir=directory, prefix=TEMPORARY_PREFIX
+        )
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            name = os.path.join(
+                os.path.dirname(name),
+                digest.hexdigest() + os.path.splitext(name)[1].lower()
+            )
+            touch_media_file(name.replace('\\', '/'))
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                os.unlink(temporary_path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary_path, self.file_permissions_mode)
+                os.replace(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        return name.replace('\\', '/')
@@ -0,0 +1,409 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock, skipUnless
+
+from api.fields import RecipeImageField
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+from users.models import Follow
+
+from . import images
+from .models import (
+    Favorite,
+    Ingredient,
+    MediaFile,
+    Recipe,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Tag,
+)
+from .search import search_recipes
+from .storage import TEMPORARY_PREFIX
+
+User = get_user_model()
+
+
+def png_bytes(size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class InlineExecutor:
+    """Пул, выполняющий задачу сразу в текущем процессе."""
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class BrokenExecutor(InlineExecutor):
+    """Пул, процесс которого погиб."""
+
+    def submit(self, function, *args):
+        raise BrokenProcessPool()
+
+
+@override_settings(IMAGE_PROCESS_WORKERS=1)
+class ProcessImageTests(SimpleTestCase):
+
+    def setUp(self):
+        images.get_executor.cache_clear()
+        self.addCleanup(images.get_executor.cache_clear)
+
+    def create_pools(self, *executors):
+        return mock.patch.object(
+            images, 'ProcessPoolExecutor', side_effect=executors
+        )
+
+    def test_broken_pool_is_replaced(self):
+        with self.create_pools(BrokenExecutor(), InlineExecutor()) as pool:
+            image = images.process_image(png_bytes())
+        self.assertEqual(pool.call_count, 2)
+        self.assertTrue(image.name.endswith('.jpg'))
+        self.assertIsInstance(images.get_executor(), InlineExecutor)
+
+    def test_broken_twice(self):
+        with self.create_pools(BrokenExecutor(), BrokenExecutor()):
+            with self.assertRaises(BrokenProcessPool):
+                images.process_image(png_bytes())
+        self.assertEqual(images.get_executor.cache_info().currsize, 0)
+
+    def test_field_reports_broken_pool(self):
+        data = base64.b64encode(png_bytes()).decode()
+        with self.create_pools(BrokenExecutor(), BrokenExecutor()):
+            with self.assertRaises(serializers.ValidationError):
+                RecipeImageField().to_internal_value(data)
+
+
+@override_settings(IMAGE_PROCESS_WORKERS=0)
+class RecipeImageFieldTests(SimpleTestCase):
+
+    def test_decoded_once(self):
+        data = 'data:image/png;base64,' + base64.b64encode(
+            png_bytes()
+        ).decode()
+        with mock.patch.object(
+            Image, 'open', wraps=Image.open
+        ) as image_open:
+            image = RecipeImageField().to_internal_value(data)
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual(image.variants[0][0], 40)
+
+    def test_invalid_data(self):
+        for data in ('не base64', base64.b64encode(b'text').decode()):
+            with self.assertRaises(serializers.ValidationError):
+                RecipeImageField().to_internal_value(data)
+
+    def test_unsupported_format(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'BMP')
+        with self.assertRaises(serializers.ValidationError):
+            RecipeImageField().to_internal_value(
+                base64.b64encode(buffer.getvalue()).decode()
+            )
+
+
+INGREDIENTS_CSV = """name,measurement_unit
+мука,г
+ сахар , г
+мука,г
+,г
+{long_name},г
+соль,г
+"""
+
+TAGS_CSV = """name,color,slug
+Завтрак,#A9E70E,breakfast
+Обед,#EEA90B,lunch
+"""
+
+
+class LoadDataTests(TransactionTestCase):
+    """load_data: COPY на PostgreSQL и пакетная загрузка через ORM.
+
+    Каждая загрузка - своя транзакция, как при запуске команды.
+    """
+
+    def write_file(self, content):
+        file, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(file, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def load(self, ingredients=None, tags=TAGS_CSV, **options):
+        if ingredients is None:
+            ingredients = INGREDIENTS_CSV.format(long_name='я' * 201)
+        output = io.StringIO()
+        call_command(
+            'load_data',
+            ingredients=self.write_file(ingredients),
+            tags=self.write_file(tags),
+            stdout=output,
+            **options
+        )
+        return output.getvalue()
+
+    def assert_loaded(self, **options):
+        output = self.load(**options)
+        self.assertIn('добавлено 3, без изменений 1, пропущено 2', output)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('мука', 'г'), ('сахар', 'г'), ('соль', 'г')},
+        )
+        output = self.load(**options)
+        self.assertIn('добавлено 0, без изменений 4, пропущено 2', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+    def test_orm(self):
+        self.assert_loaded(no_copy=True)
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY есть в PostgreSQL')
+    def test_copy(self):
+        self.assert_loaded()
+
+    def test_tags_are_updated(self):
+        self.load()
+        output = self.load(tags=TAGS_CSV.replace('#EEA90B', '#000000'))
+        self.assertIn('добавлено 0, изменено 1, без изменений 1', output)
+        self.assertEqual(Tag.objects.get(slug='lunch').color, '#000000')
+
+    def test_wrong_header(self):
+        with self.assertRaisesMessage(CommandError, 'ожидались столбцы'):
+            self.load(ingredients='title,unit\nмука,г\n')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'планы EXPLAIN PostgreSQL')
+class IndexUsageTests(TestCase):
+    """Запросы фильтров и сортировок используют свои индексы.
+
+    На пустых таблицах последовательное чтение дешевле любого индекса,
+    поэтому оно запрещается и проверяется только возможность выбрать
+    индекс: без подходящего индекса план всё равно будет Seq Scan.
+    """
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            # Действует до отката транзакции теста.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def index_names(self, model, columns):
+        """Индексы таблицы model, начинающиеся со столбцов columns."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table
+            )
+        return {
+            name for name, constraint in constraints.items()
+            if constraint['index'] or constraint['unique']
+            if constraint['columns'][:len(columns)] == list(columns)
+        }
+
+    def assert_index_used(self, queryset, indexes):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertTrue(
+            any(index in plan for index in indexes),
+            f'ни один из {sorted(indexes)} не выбран:\n{plan}'
+        )
+
+    def test_recipes_list(self):
+        self.assert_index_used(
+            Recipe.objects.order_by('-created', 'id')[:6],
+            {'recipe_created_id_idx'},
+        )
+
+    def test_recipes_popular(self):
+        self.assert_index_used(
+            Recipe.objects.order_by('-favorites_count', '-created', 'id')[:6],
+            {'recipe_popular_idx'},
+        )
+
+    def test_recipes_author(self):
+        user = User(id=1)
+        for queryset in (
+            Recipe.objects.filter(author=user).order_by('-created')[:6],
+            Recipe.objects.filter(author=user).values('id')[:3],
+        ):
+            with self.subTest(query=str(queryset.query)):
+                self.assert_index_used(
+                    queryset, {'recipe_author_created_idx'}
+                )
+
+    def test_user_recipe(self):
+        for model in (Favorite, ShoppingCart):
+            with self.subTest(model=model.__name__):
+                self.assert_index_used(
+                    model.objects.filter(user_id=1, recipe_id=1),
+                    self.index_names(model, ('user_id', 'recipe_id')),
+                )
+
+    def test_follow_user(self):
+        self.assert_index_used(
+            Follow.objects.filter(user_id=1).order_by('-id')[:6],
+            {'follow_user_id_idx'},
+        )
+
+    def test_ingredient_name_prefix(self):
+        self.assert_index_used(
+            Ingredient.objects.filter(name__istartswith='мол'),
+            {'ingredient_upper_name_idx'},
+        )
+
+    def test_recipe_search(self):
+        self.assert_index_used(
+            search_recipes(Recipe.objects.all(), 'суп'),
+            {'recipes_recipe_search_vector_gin'},
+        )
+
+
+class AdminTests(SimpleTestCase):
+    """Денормализованные данные в админке только для просмотра."""
+
+    def test_shopping_cart_total_read_only(self):
+        model_admin = admin.site._registry[ShoppingCartTotal]
+        request = RequestFactory().get('/')
+        self.assertFalse(model_admin.has_add_permission(request))
+        self.assertFalse(model_admin.has_change_permission(request))
+        self.assertFalse(model_admin.has_delete_permission(request))
+
+    def test_media_file_references_read_only(self):
+        model_admin = admin.site._registry[MediaFile]
+        self.assertIn('references', model_admin.readonly_fields)
+
+
+class MediaFileTests(TestCase):
+    """Хранилище по содержимому, счётчики ссылок и сборка мусора."""
+    upload_to = 'recipes/images/'
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com', password='x'
+        )
+
+    def save(self, content, name='image.jpg'):
+        return default_storage.save(
+            self.upload_to + name, ContentFile(content)
+        )
+
+    def create_recipe(self, image):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', image=image, text='Текст',
+            cooking_time=10
+        )
+
+    def references(self, name):
+        return MediaFile.objects.get(name=name).references
+
+    def make_old(self, *names):
+        MediaFile.objects.filter(name__in=names).update(
+            touched=timezone.now() - timedelta(days=2)
+        )
+
+    def collect(self, *args):
+        output = io.StringIO()
+        call_command('collect_media_garbage', *args, stdout=output)
+        return output.getvalue()
+
+    def test_deduplication(self):
+        first = self.save(b'content', 'first.JPG')
+        second = self.save(b'content', 'second.jpg')
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith('.jpg'))
+        directory = os.path.dirname(default_storage.path(first))
+        self.assertEqual(os.listdir(directory), [os.path.basename(first)])
+        self.assertEqual(self.references(first), 0)
+
+    def test_references(self):
+        old, new = self.save(b'old'), self.save(b'new')
+        first = self.create_recipe(old)
+        second = self.create_recipe(old)
+        self.assertEqual(self.references(old), 2)
+        first.image = new
+        first.save()
+        self.assertEqual(self.references(old), 1)
+        self.assertEqual(self.references(new), 1)
+        second.delete()
+        self.assertEqual(self.references(old), 0)
+
+    def test_collect(self):
+        referenced = self.save(b'referenced')
+        self.create_recipe(referenced)
+        garbage = self.save(b'garbage')
+        recent = self.save(b'recent')
+        self.make_old(referenced, garbage)
+        self.assertIn('Удалено файлов: 1', self.collect())
+        self.assertTrue(default_storage.exists(referenced))
+        self.assertTrue(default_storage.exists(recent))
+        self.assertFalse(default_storage.exists(garbage))
+        self.assertFalse(MediaFile.objects.filter(name=garbage).exists())
+        # Повторная загрузка удалённого файла записывает его заново.
+        self.assertEqual(self.save(b'garbage'), garbage)
+        self.assertTrue(default_storage.exists(garbage))
+
+    def test_dry_run(self):
+        garbage = self.save(b'garbage')
+        self.make_old(garbage)
+        self.assertIn(garbage, self.collect('--dry-run'))
+        self.assertTrue(default_storage.exists(garbage))
+
+    def test_file_without_row(self):
+        name = self.save(b'orphan')
+        MediaFile.objects.filter(name=name).delete()
+        self.assertIn('Удалено файлов: 0', self.collect())
+        self.assertEqual(self.references(name), 0)
+        self.make_old(name)
+        self.assertIn('Удалено файлов: 1', self.collect())
+        self.assertFalse(default_storage.exists(name))
+
+    def test_temporary_files(self):
+        directory = default_storage.path(self.upload_to)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, TEMPORARY_PREFIX + 'upload')
+        open(path, 'wb').close()
+        self.collect()
+        self.assertTrue(os.path.exists(path))
+        old = (timezone.now() - timedelta(days=2)).timestamp()
+        os.utime(path, (old, old))
+        self.collect()
+        self.assertFalse(os.path.exists(path))
+
+    def test_recount(self):
+        name = self.save(b'image')
+        self.create_recipe(name)
+        stale = self.save(b'stale')
+        MediaFile.objects.filter(name=name).update(references=5)
+        MediaFile.objects.filter(name=stale).update(references=3)
+        self.assertIn('исправлено 2', self.collect('--recount'))
+        self.assertEqual(self.references(name), 1)
+        self.assertEqual(self.references(stale), 0)
@@ -0,0 +1,107 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Favorite, RecipeActivity, ShoppingCart, TrendingRecipe
+
+FAVORITE_WEIGHT = 1.0
+CART_WEIGHT = 2.0
+WEEK_DAYS = 7
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+@transaction.atomic
+def update_activity(now):
+    """Пересчитывает суточные агрегаты, начиная со вчерашнего дня.
+
+    Вчерашний день пересчитывается заново, чтобы учесть добавления из
+    транзакций, закоммиченных после прошлого запуска. Агрегаты старше
+    окна удаляются. Возвращает число записанных строк.
+    """
+    today = timezone.localdate(now)
+    window_start = today - timedelta(days=settings.TRENDING_WINDOW_DAYS - 1)
+    last = RecipeActivity.objects.aggregate(last=Max('day'))['last']
+    start = window_start
+    if last is not None:
+        start = max(min(last, today) - timedelta(days=1), window_start)
+    counts = defaultdict(lambda: [0, 0])
+    for index, model in enumerate((Favorite, ShoppingCart)):
+        rows = model.objects.filter(
+            created__gte=day_start(start)
+        ).annotate(
+            day=TruncDate('created')
+        ).order_by().values('recipe', 'day').annotate(count=Count('id'))
+        for row in rows.iterator():
+            counts[row['recipe'], row['day']][index] += row['count']
+    RecipeActivity.objects.filter(day__gte=start).delete()
+    RecipeActivity.objects.filter(day__lt=window_start).delete()
+    RecipeActivity.objects.bulk_create(
+        (
+            RecipeActivity(
+                recipe_id=recipe_id,
+                day=day,
+                favorites=favorites,
+                carts=carts,
+            )
+            for (recipe_id, day), (favorites, carts) in counts.items()
+        ),
+        batch_size=1000,
+    )
+    return len(counts)
+
+
+def compute_scores(now):
+    """Оценки рецептов по периодам рейтинга из суточных агрегатов.
+
+    Добавления за сутки считаются сделанными в середине суток (для
+    текущих - в середине прошедшей их части).
+    """
+    today = timezone.localdate(now)
+    week_start = today - timedelta(days=WEEK_DAYS - 1)
+    half_life = settings.TRENDING_HALF_LIFE_HOURS * 3600
+    scores = {
+        TrendingRecipe.TRENDING: defaultdict(float),
+        TrendingRecipe.WEEK: defaultdict(float),
+    }
+    for recipe_id, day, favorites, carts in (
+        RecipeActivity.objects.values_list(
+            'recipe', 'day', 'favorites', 'carts'
+        ).iterator()
+    ):
+        score = favorites * FAVORITE_WEIGHT + carts * CART_WEIGHT
+        start = day_start(day)
+        middle = start + min(now - start, timedelta(days=1)) / 2
+        age = max((now - middle).total_seconds(), 0)
+        scores[TrendingRecipe.TRENDING][recipe_id] += (
+            score * 0.5 ** (age / half_life)
+        )
+        if day >= week_start:
+            scores[TrendingRecipe.WEEK][recipe_id] += score
+    return scores
+
+
+@transaction.atomic
+def update_rankings(now):
+    """Заменяет рейтинги первыми TRENDING_SIZE рецептами по оценке."""
+    sizes = {}
+    for period, scores in compute_scores(now).items():
+        top = sorted(
+            scores.items(), key=lambda item: (-item[1], -item[0])
+        )[:settings.TRENDING_SIZE]
+        TrendingRecipe.objects.filter(period=period).delete()
+        TrendingRecipe.objects.bulk_create(
+            TrendingRecipe(
+                period=period, rank=rank, recipe_id=recipe_id, score=score
+            )
+            for rank, (recipe_id, score) in enumerate(top, start=1)
+        )
+        sizes[period] = len(top)
+    return sizes
@@ -9,7 +9,10 @@ class UserAdmin(admin.ModelAdmin):
     list_display = (
         'username',
         'id',
+        'recipes_count',
+        'followers_count',
     )
+    readonly_fields = ('recipes_count', 'followers_count')
 
 
 @admin.register(Follow)
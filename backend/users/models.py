@@ -1,9 +1,11 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
 from django.forms import ValidationError
+from recipes.counters import CountersModelMixin
 
 
-class User(AbstractUser):
+class User(CountersModelMixin, AbstractUser):
     """Модель пользователя."""
     email = models.EmailField(
         unique=True,
@@ -13,6 +15,22 @@ class User(AbstractUser):
         help_text='Введи свою почту!'
     )
 
+    recipes_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    followers_count = models.IntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
+    updated = models.DateTimeField(
+        auto_now=True,
+        null=True,
+        verbose_name='Дата изменения',
+    )
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 
@@ -39,6 +57,9 @@ class Follow(models.Model):
     class Meta:
         ordering = ('-id',)
         unique_together = ('user', 'author')
+        indexes = [
+            models.Index(fields=['user', '-id'], name='follow_user_id_idx'),
+        ]
 
     def clean(self):
         if self.user == self.author:
@@ -48,3 +69,14 @@ class Follow(models.Model):
 
     def __str__(self):
         return f'{self.user}'
+
+
+def with_is_subscribed(users, user):
+    """Аннотирует пользователей users флагом is_subscribed для user."""
+    if user.is_anonymous:
+        return users.annotate(
+            is_subscribed=Value(False, output_field=BooleanField())
+        )
+    return users.annotate(is_subscribed=Exists(Follow.objects.filter(
+        user=user, author=OuterRef('pk')
+    )))